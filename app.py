@@ -1,17 +1,22 @@
 import plotly.graph_objects as go
 from shiny import App, render, ui, reactive, req
 from shinywidgets import output_widget, render_plotly
+import asyncio
 import datetime
 import requests
 import pandas as pd
-import numpy as np
 import os
 from dotenv import load_dotenv
-import pickle
 from pathlib import Path
+from urllib.parse import parse_qs
+from starlette.routing import Route
 
-from methods import methods_ui, methods_server
+import cache
+import degree_days as dd
 import functions as fx
+import household
+import metrics
+import uncertainty
 
 load_dotenv() 
 
@@ -19,7 +24,6 @@ m3_per_kwh = 19.3 / 212.8
 typical_cooking = [i * m3_per_kwh for i in [66, 90, 88, 99, 105, 110, 115, 120, 125, 130, 135]]
 
 month_list = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-month_days = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 app_ui = ui.page_fluid(
   ui.tags.link(href="styles.css", rel="stylesheet"),
@@ -36,7 +40,7 @@ app_ui = ui.page_fluid(
         ui.sidebar(
           ui.input_slider("floor_area", "What is your floor area in square metres?", min = 1, max = 300, step = 1, value = 70),
           ui.input_slider("occupants", "How many people live in your property?", min = 1, max = 10, step = 1, value = 2),
-          ui.input_select("start_month", "Which month do you switch on your heating?", choices = month_list[8:11], selected = 2),
+          ui.input_select("start_month", "Which month do you switch on your heating?", choices = month_list, selected = "September"),
           ui.accordion(
             ui.accordion_panel("Fetch your own data",
               ui.markdown("Get your Octopus API key from [here](https://octopus.energy/dashboard/new/accounts/personal-details/api-access)"),
@@ -132,7 +136,7 @@ app_ui = ui.page_fluid(
       ui.layout_columns(
         None,
         ui.card(
-          methods_ui("methods"),
+          ui.output_ui("about"),
         ),
         None,
       col_widths={
@@ -145,26 +149,40 @@ app_ui = ui.page_fluid(
   ),
   ui.markdown("Built with [Shiny for python](https://shiny.posit.co/py/). [Source code](https://github.com/simon-smart88/gasbench)"),
   title = "Gas benchmarking",
-  theme = ui.Theme("cerulean")
+  theme = cache.theme_dependency("cerulean")
         #cooking_bool = st.radio("Do you use gas for cooking?",("Yes", "No"))
 )
 
+parameters = fx.load_models()
+
+# shaded range of the typical use from the uncertainty in the fitted models, as one closed shape
+# drawn under the lines in the colour of the typical line
+typical_colour = "#636efa"
+
+def typical_band_trace(bands):
+  x = bands["date"].dt.strftime("%Y-%m-%d").tolist()
+  return go.Scatter(x = x + x[::-1], y = bands["p95"].tolist() + bands["p5"].tolist()[::-1], fill = "toself", fillcolor = "rgba(99, 110, 250, 0.2)",
+    line = dict(width = 0), hoverinfo = "skip", name = "Typical range (5-95%)")
+
+if os.getenv("WARM_TYPICAL_GAS"):
+  fx.warm_typical_gas(parameters)
+
 def server(input, output, session):
-  
-  methods_server("methods")
-  
-  with open("fitted_models.pkl", "rb") as f:
-    parameters = pickle.load(f)
-  
-  @reactive.calc
-  def month_offset():
-    return sum(month_days[0:month_list.index(input.start_month())])
+
+  # add ?trace to the url to log the timings of this session
+  @reactive.effect(priority = 100)
+  def start_trace():
+    if metrics.trace_all or "trace" in parse_qs(input[".clientdata_url_search"]().lstrip("?"), keep_blank_values = True):
+      metrics.start_trace(session.id)
+  session.on_ended(lambda: metrics.end_trace(session.id))
   
   @reactive.calc
+  @metrics.instrument("calc")
   def month_number():
     return month_list.index(input.start_month()) + 1
   
   @reactive.calc
+  @metrics.instrument("calc")
   def octopus_secrets():
     # if input.octopus_key() == "" or input.octopus_gas_point() == "" or input.octopus_gas_meter() == "":
     #   octopus_secrets = {"key": os.getenv("OCTOPUS_KEY"), "gas_point": os.getenv("OCTOPUS_GAS_POINT"), "gas_meter": os.getenv("OCTOPUS_GAS_METER")}
@@ -173,6 +191,7 @@ def server(input, output, session):
     return octopus_secrets
   
   @reactive.calc
+  @metrics.instrument("calc")
   def postcode():
     if input.postcode() == "":
       postcode = os.getenv("POSTCODE")
@@ -180,104 +199,106 @@ def server(input, output, session):
       postcode = input.postcode()
     return postcode
 
-  @reactive.calc
-  def gas_standing_cost():
-    return fx.get_cost_data("gas", "standing")
-    
-  @reactive.calc
-  def gas_unit_cost():
-    return fx.get_cost_data("gas", "unit")
+  # the slow fetches run as extended tasks so independent requests overlap and other sessions aren't blocked
+  @reactive.extended_task
+  @metrics.instrument("task")
+  async def gas_data_task(octopus_secrets):
+    return await fx.fetch_daily_gas_data(octopus_secrets)
+
+  @reactive.extended_task
+  @metrics.instrument("task")
+  async def climate_data_task(postcode, end_date):
+    return await asyncio.to_thread(fx.get_climate_data, postcode, "2020-11-01", end_date)
+
+  @reactive.effect
+  def fetch_gas_data():
+    gas_data_task.cancel()
+    gas_data_task.invoke(octopus_secrets())
+
+  @reactive.effect
+  def fetch_climate_data():
+    yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
+    climate_data_task.cancel()
+    climate_data_task.invoke(postcode(), yesterday)
 
   @reactive.calc
+  @metrics.instrument("calc")
   def daily_gas_data():
-    # req(gas_standing_cost())
-    # req(gas_unit_cost())
-    return fx.get_daily_gas_data(octopus_secrets(), gas_standing_cost(), gas_unit_cost())
+    return gas_data_task.result()
 
   @reactive.calc
+  @metrics.instrument("calc")
+  def season_gas_data():
+    return fx.shared_pivots(fx.consumption_identity(octopus_secrets()), daily_gas_data(), month_number())
+
+  @reactive.calc
+  @metrics.instrument("calc")
   def overall_gas_data():
-    return fx.pivot_to_season(daily_gas_data(), input.start_month(), "overall", month_offset(), month_number())
+    return season_gas_data()["overall"]
   
   @reactive.calc
+  @metrics.instrument("calc")
   def overall_typical_gas_data():
-    return fx.get_typical_gas(parameters, input.floor_area(), input.occupants(), month_list.index(input.start_month()) + 1, "overall")
+    return fx.get_typical_gas(parameters, input.floor_area(), input.occupants(), month_number(), "overall")
   
   @reactive.calc
-  def typical_gas_cost():
-    return fx.get_typical_gas_cost(overall_typical_gas_data(), daily_gas_data())
-  
+  @metrics.instrument("calc")
+  def overall_typical_gas_bands():
+    return uncertainty.get_typical_gas_bands(parameters, input.floor_area(), input.occupants(), month_number(), "overall")
+
   @reactive.calc
+  @metrics.instrument("calc")
   def heating_gas_data():
-    return fx.pivot_to_season(daily_gas_data(), input.start_month(), "heating", month_offset(), month_number())
+    return season_gas_data()["heating"]
 
   @reactive.calc
+  @metrics.instrument("calc")
   def heating_typical_gas_data():
-    return fx.get_typical_gas(parameters, input.floor_area(), input.occupants(), month_list.index(input.start_month()) + 1, "heating")
-  
-  @reactive.calc
-  def current_dos():
-    return overall_gas_data().iloc[:,-1].index.get_loc(overall_gas_data().iloc[:,-1].last_valid_index())
+    return fx.get_typical_gas(parameters, input.floor_area(), input.occupants(), month_number(), "heating")
 
   @reactive.calc
-  def latest_gas_sum():
-    return daily_gas_data()["consumption"].tail(365).sum()
+  @metrics.instrument("calc")
+  def heating_typical_gas_bands():
+    return uncertainty.get_typical_gas_bands(parameters, input.floor_area(), input.occupants(), month_number(), "heating")
   
   @reactive.calc
-  def typical_gas_sum():
-    return overall_typical_gas_data()["cum"].tail(1).min()
+  @metrics.instrument("calc")
+  def summary():
+    return household.summarise_household(daily_gas_data(), season_gas_data(), overall_typical_gas_data())
   
   @reactive.calc
-  def typical_gas_sd():
-    return 2809.077 * np.exp(0.00005240616 * typical_gas_sum())
+  @metrics.instrument("calc")
+  def climate_data():
+    return pd.merge(daily_gas_data(), climate_data_task.result(), right_index = True, left_index = True)
 
+  # daily use against temperature over the last year with the temperature the heating comes on at
   @reactive.calc
-  def overall_gas_diff():
-    n_years = len(overall_gas_data().columns) - 1
-    this_year = overall_typical_gas_data()["cum"][current_dos()]
-    total_typical = (typical_gas_sum() * n_years) + this_year
-    total_actual = daily_gas_data()["consumption"].sum()
-    return total_typical - total_actual
-  
-  @reactive.calc
-  def climate_data():
-    yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
-    climate_data = fx.get_climate_data(postcode(), "2020-11-01", yesterday)
-    return pd.merge(daily_gas_data(), climate_data, right_index = True, left_index = True)
+  @metrics.instrument("calc")
+  def temperature_response():
+    df = climate_data().tail(365)
+    return dd.fit_changepoint(df["tavg"], df["consumption"])
 
   @reactive.calc
+  @metrics.instrument("calc")
   def climate_benchmark_data():
-    df = climate_data()
-    
-    # df = fx.get_serl_data(2, "Figure_5")
-    # df = df[df["quantity"] == "Gas"]
-    # mean_df = df.groupby(["segment_3_value"]).mean().reset_index()
-    # mean_df["relative_value"] = mean_df["median"] / mean_df.loc[mean_df["segment_3_value"] == "15_to_20", "median"].squeeze()
-    
-    # benchmark data derived from above
-    temp_response = [13.09, 10.45, 7.07, 2.95, 1, 0.75]
-    bin_edges = [-5, 0, 5, 10, 15, 20, 25]
-    bin_labels = ["-5 to 0", "0 to 5", "5 to 10", "10 to 15", "15 to 20", "20 to 25"]
-    df["temperature_bins"] = pd.cut(df["tavg"], bins = bin_edges, labels = bin_labels, right = False)
-    df = df.tail(365)
-    mean_values = pd.DataFrame(df.groupby("temperature_bins")[["consumption", "tavg"]].mean())
-    mean_values["benchmark"] = temp_response
-    mean_values["benchmark"] = mean_values["benchmark"] * mean_values["consumption"][4]
-    return mean_values  
+    return household.temperature_bins(climate_data())
 
   @render.ui
+  @metrics.instrument("render")
   def gas_usage():
     return ui.value_box(
       "Gas used in the last year",
-      f"{int(latest_gas_sum())} kWh",
-      f"Enough to boil {int(latest_gas_sum() * 10.08 / 365)} kettles every day",
+      f"{int(summary().latest_gas_sum)} kWh",
+      f"Enough to boil {int(summary().latest_gas_sum * 10.08 / 365)} kettles every day",
       # 3600000 / 357000 (4200 j per l per C * 85 C)
       showcase = ui.tags.i(class_ = "fas fa-fire-flame-simple"),
       theme = "blue"
     )
   
   @render.ui
+  @metrics.instrument("render")
   def gas_compare():
-    diff_percent = (typical_gas_sum() - latest_gas_sum()) / typical_gas_sum() * 100
+    diff_percent = summary().gas_diff_percent
     if diff_percent > 0:
       icon = "fas fa-arrow-down"
       diff = "lower"
@@ -297,8 +318,9 @@ def server(input, output, session):
       theme = theme)
   
   @render.ui
+  @metrics.instrument("render")
   def co2_emissions():
-    co2 = int(latest_gas_sum() * 0.203)
+    co2 = int(summary().co2)
     return ui.value_box(
       "CO₂ emissions in the last year",
       f"{co2} kg",
@@ -309,8 +331,9 @@ def server(input, output, session):
     )
   
   @render.ui
+  @metrics.instrument("render")
   def co2_diff():
-    co2_diff = overall_gas_diff() * 0.203
+    co2_diff = summary().co2_diff
     if co2_diff > 0:
       icon = "fas fa-arrow-down"
       diff = "saved"
@@ -329,8 +352,9 @@ def server(input, output, session):
     theme = theme)
   
   @render.ui
+  @metrics.instrument("render")
   def gas_cost():
-    cost = daily_gas_data()["cost"].tail(365).sum()
+    cost = summary().latest_cost
     return ui.value_box(
       "Cost of gas in the last year",
       f"£{int(cost)}",
@@ -340,9 +364,9 @@ def server(input, output, session):
     )
   
   @render.ui
+  @metrics.instrument("render")
   def cost_diff():
-    # req(gas_unit_cost())
-    cost_diff = (typical_gas_cost()["typical_cost"].sum() - typical_gas_cost()["cost"].sum()) / 100
+    cost_diff = summary().cost_diff
     if cost_diff > 0:
       icon = "fas fa-arrow-down"
       diff = "saved"
@@ -360,31 +384,45 @@ def server(input, output, session):
     theme = theme)
 
   @render_plotly
+  @metrics.instrument("render")
   def overall_gas_fig():
+    typical = overall_typical_gas_data()
+    bands = overall_typical_gas_bands()
+    seasons = overall_gas_data()
+    dates = seasons.index.strftime("%Y-%m-%d")
     plot = go.Figure()
-    plot.add_trace(go.Scatter(x = overall_typical_gas_data()["date"].dt.strftime("%Y-%m-%d"), y = overall_typical_gas_data()["cum"], name = "Typical", line = dict(width = 4)))
-    for column in overall_gas_data().columns[0:]:
-      plot.add_trace(go.Scatter(x = overall_gas_data().index.strftime("%Y-%m-%d"), y = overall_gas_data()[column], name = column))
+    plot.add_trace(typical_band_trace(bands))
+    plot.add_trace(go.Scatter(x = typical["date"].dt.strftime("%Y-%m-%d"), y = typical["cum"], name = "Typical", line = dict(width = 4, color = typical_colour)))
+    for column in seasons.columns:
+      plot.add_trace(go.Scatter(x = dates, y = seasons[column], name = column))
     plot.update_layout(title = "", xaxis_title = "", yaxis_title = "Gas use (kWh)", xaxis_type="date",
       xaxis = dict(tickformat = "%e %b", showgrid = False), yaxis = dict(showgrid = False), plot_bgcolor = "white",legend=dict(y=1.1, orientation="h"))
     return plot
 
   @render_plotly
+  @metrics.instrument("render")
   def heating_gas_fig():
+    typical = heating_typical_gas_data()
+    bands = heating_typical_gas_bands()
+    seasons = heating_gas_data()
+    dates = seasons.index.strftime("%Y-%m-%d")
     plot = go.Figure()
-    plot.add_trace(go.Scatter(x = heating_typical_gas_data()["date"].dt.strftime("%Y-%m-%d"), y = heating_typical_gas_data()["cum"], name = "Typical", line = dict(width = 4)))
-    for column in heating_gas_data().columns[0:]:
-      plot.add_trace(go.Scatter(x = heating_gas_data().index.strftime("%Y-%m-%d"), y = heating_gas_data()[column], name = column))
+    plot.add_trace(typical_band_trace(bands))
+    plot.add_trace(go.Scatter(x = typical["date"].dt.strftime("%Y-%m-%d"), y = typical["cum"], name = "Typical", line = dict(width = 4, color = typical_colour)))
+    for column in seasons.columns:
+      plot.add_trace(go.Scatter(x = dates, y = seasons[column], name = column))
     plot.update_layout(title = "", xaxis_title = "", yaxis_title = "Gas use (kWh)", xaxis_type="date",
       xaxis = dict(tickformat = "%e %b", showgrid = False), yaxis = dict(showgrid = False), plot_bgcolor = "white", legend=dict(y=1.1, orientation="h"))
     return plot
 
   @render_plotly
+  @metrics.instrument("render")
   def benchmark_fig():
-    plot = fx.bench_fig(typical_gas_sum(), typical_gas_sd(), latest_gas_sum(), "gas")
+    plot = fx.bench_fig(summary().typical_gas_sum, summary().typical_gas_sd, summary().latest_gas_sum, "gas")
     return plot
   
   @render_plotly
+  @metrics.instrument("render")
   def weekly_climate_fig():
     df = climate_data()
     # df = df.drop(["interval_start"], axis = 1)
@@ -401,6 +439,7 @@ def server(input, output, session):
     return(plot)
 
   @render_plotly
+  @metrics.instrument("render")
   def climate_benchmark_fig():
 
     df = climate_benchmark_data()
@@ -420,28 +459,30 @@ def server(input, output, session):
     return plot
 
   @render_plotly
+  @metrics.instrument("render")
   def compare_recent_days_fig():
     yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
-    df = fx.compare_years(climate_data(), yesterday)
-    # may not be sensible assuming this is always linear
-    baseline = climate_benchmark_data()[climate_benchmark_data()["tavg"] < 17.5]
-    df["expected"] = fx.expected_from_temperature(df["tavg"].tolist(), baseline["tavg"], baseline["consumption"])
+    df = dd.compare_years(climate_data(), yesterday)
+    df["expected"] = dd.degree_day_response(df["tavg"], temperature_response())
     years = df.index.year.unique()
     plot = go.Figure()
     x_values = df.index[df.index.year == years[-1]].strftime("%Y-%m-%d")
     for year in years[-1:]:
     #for year in years:
       plot.add_trace(go.Bar(name=year, x=x_values, y=df["consumption"][df.index.year == year]))
-    plot.add_trace(go.Bar(name="Expected from temperature", x=x_values, y=df["expected"][df.index.year == year]))
+    fit = temperature_response()
+    expected_name = f"Expected from temperature (heating below {fit['base_temperature']:.1f}°C)" if fit["slope"] != 0 else "Expected from temperature"
+    plot.add_trace(go.Bar(name=expected_name, x=x_values, y=df["expected"][df.index.year == year]))
     plot.update_layout(xaxis = dict(tickformat = "%e %b"), plot_bgcolor = "white", legend=dict(y=1.1, orientation="h"))
     return plot
 
   @render_plotly
+  @metrics.instrument("render")
   def heating_demand_benchmark_fig():
     values = [15, 25, 30,	50,	85,	125]
     standards = ["Passive House",	"EnerPHit",	"PHI Low Energy Building", "AECB CarbonLite Retrofit", "Average UK New Build", "Average UK House"]
     # uses total of previous heating season
-    heating_demand = heating_gas_data().iloc[:,-2:-1].tail(1).squeeze()
+    heating_demand = summary().previous_heating_total
     demand_per_m2 = heating_demand / input.floor_area()
     values.append(demand_per_m2)
     standards.append("Your property")
@@ -453,6 +494,14 @@ def server(input, output, session):
     plot.update_layout(xaxis = dict(title = "kWh/m²/yr"), plot_bgcolor = "white", legend=dict(y=1.1, orientation="h"), yaxis = dict(title = "", showticklabels = False))
     return plot
 
+  # outputs in hidden tabs are suspended, so the About tab is only built when it is first opened
+  @render.ui
+  @metrics.instrument("render")
+  def about():
+    from methods import methods_ui
+    return methods_ui("methods")
+
   
 www_dir = Path(__file__).parent / "www"
 app = App(app_ui, server, static_assets = www_dir)
+app.starlette_app.routes.insert(0, Route("/metrics", metrics.endpoint))
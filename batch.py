@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark many households at once without the app
+
+python batch.py households.csv results.csv --workers 8
+
+The input has one row per household per day with the columns
+property_id, floor_area, occupants, start_month, date, consumption (kWh)
+where start_month is the month the heating is switched on, as a name or number.
+CSV or Parquet is read and written depending on the file extension.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import functions as fx
+
+def read_table(path):
+  if str(path).endswith(".parquet"):
+    return pd.read_parquet(path)
+  return pd.read_csv(path)
+
+def write_table(df, path):
+  if str(path).endswith(".parquet"):
+    df.to_parquet(path, index = False)
+  else:
+    df.to_csv(path, index = False)
+
+def month_number(month):
+  if isinstance(month, str) and not month.isdigit():
+    return fx.month_list.index(month.capitalize()) + 1
+  return int(month)
+
+# the number of complete years and the day of the current season of every household from the days with a reading,
+# counting the seasons the pivots keep, which are those with a reading in their first 9 days
+def season_positions(df, start_months):
+  valid = df["consumption"].notna().to_numpy()
+  dates = df["date"].to_numpy(dtype = "datetime64[D]")[valid]
+  season, dos = fx.season_days(dates, df["property_id"].map(start_months).to_numpy()[valid])
+  days = pd.DataFrame({"property_id": df["property_id"].to_numpy()[valid], "season": season, "dos": dos})
+  seasons = days.groupby(["property_id", "season"])["dos"].agg(["min", "max"])
+  seasons = seasons[seasons["min"] < 9].groupby(level = "property_id")
+  return seasons.size() - 1, seasons["max"].last()
+
+def benchmark_chunk(df, parameters):
+  df = df.sort_values(["property_id", "date"])
+  df["date"] = pd.to_datetime(df["date"])
+  households = df.groupby("property_id", sort = False).first()[["floor_area", "occupants", "start_month"]]
+  households["start_month"] = households["start_month"].map(month_number)
+  households["latest_gas_sum"] = df.groupby("property_id", sort = False).tail(365).groupby("property_id", sort = False)["consumption"].sum()
+  households["total_gas"] = df.groupby("property_id", sort = False)["consumption"].sum()
+
+  households["n_years"], households["current_dos"] = season_positions(df, households["start_month"])
+
+  scale = fx.typical_gas_scale(parameters, households["floor_area"].to_numpy(dtype = float), households["occupants"].to_numpy(dtype = float))
+  typical_sum = np.empty(len(households))
+  this_year = np.empty(len(households))
+  for start_month in households["start_month"].unique():
+    basis = fx.typical_gas_basis(tuple(parameters["gas_from_day_popt"]), start_month, "overall")
+    rows = (households["start_month"] == start_month).to_numpy()
+    typical_sum[rows] = basis["daily"].sum(dtype = float) * scale[rows]
+    this_year[rows] = np.cumsum(basis["daily"], dtype = float)[households["current_dos"].to_numpy()[rows]] * scale[rows]
+  households["typical_gas_sum"] = typical_sum
+  households["typical_gas_sd"] = fx.typical_gas_sd(typical_sum)
+  households["overall_gas_diff"] = (typical_sum * households["n_years"]) + this_year - households["total_gas"]
+  households["co2"] = households["latest_gas_sum"] * 0.203
+  households["co2_diff"] = households["overall_gas_diff"] * 0.203
+  position = fx.benchmark_position(typical_sum, households["typical_gas_sd"].to_numpy(), households["latest_gas_sum"].to_numpy())
+  households["percentile"] = position["percentile"]
+  households["band"] = position["band"]
+  return households.reset_index()
+
+def benchmark(df, parameters, workers = None, chunk_size = 500):
+  # chunks of chunk_size households cut at the rows where a household starts in the frame sorted by household
+  df = df.sort_values("property_id", kind = "stable")
+  ids = df["property_id"].to_numpy()
+  starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+  bounds = np.append(starts[::chunk_size], len(df))
+  chunks = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+  with ProcessPoolExecutor(max_workers = workers) as pool:
+    results = list(pool.map(benchmark_chunk, chunks, [parameters] * len(chunks)))
+  return pd.concat(results, ignore_index = True)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Benchmark the gas use of many households")
+  parser.add_argument("households")
+  parser.add_argument("results")
+  parser.add_argument("--workers", type = int, default = None)
+  parser.add_argument("--chunk-size", type = int, default = 500)
+  args = parser.parse_args()
+
+  write_table(benchmark(read_table(args.households), fx.load_models(), args.workers, args.chunk_size), args.results)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time the hot paths in functions.py on synthetic 1, 5 and 20 year histories built from the
+bundled 2020-2025_data.csv, with the Octopus API replaced by canned responses
+
+python benchmarks.py              compare with benchmarks.json and exit with 1 on a regression
+python benchmarks.py --save       save the results as the new baseline
+python benchmarks.py --only pivot_to_season --years 20
+
+Timings are the median of --repeat runs and the memory is the peak traced by tracemalloc over
+a separate run. Baselines are only comparable on the machine they were saved on.
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import cache
+import degree_days as dd
+import functions as fx
+import uncertainty
+
+baseline_path = Path(__file__).parent / "benchmarks.json"
+history_years = [1, 5, 20]
+
+# daily use (m3) and mean temperature ending on the last day of the bundled data, each year
+# following the bundled data's average day of year profile with some noise
+def history(years, seed = 1):
+    bundled = pd.read_csv(Path(__file__).parent / "2020-2025_data.csv", parse_dates = ["date"])
+    profile = bundled.groupby(bundled["date"].dt.dayofyear)["daily_consumption"].mean().reindex(range(1, 367)).interpolate()
+    dates = pd.date_range(end = bundled["date"].max(), periods = round(365.25 * years), freq = "D")
+    rng = np.random.default_rng(seed)
+    consumption = profile.to_numpy()[dates.dayofyear - 1] * rng.lognormal(0, 0.2, len(dates))
+    tavg = 10 - 7 * np.cos(2 * np.pi * (dates.dayofyear - 15) / 365) + rng.normal(0, 2, len(dates))
+    return pd.DataFrame({"consumption": consumption.round(3), "tavg": tavg.round(1)}, index = dates)
+
+# stands in for requests in functions.py, answering the tariff and consumption endpoints
+class FakeResponse:
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+class FakeRequests:
+
+    tariffs = [
+        {"value_exc_vat": 28.0, "value_inc_vat": 29.4, "valid_from": "2023-04-01T00:00:00Z", "valid_to": None, "payment_method": "DIRECT_DEBIT"},
+        {"value_exc_vat": 10.0, "value_inc_vat": 10.5, "valid_from": "2022-11-01T00:00:00Z", "valid_to": "2023-04-01T00:00:00Z", "payment_method": "DIRECT_DEBIT"}
+    ]
+
+    def __init__(self, daily):
+        self.daily = daily
+        self.auth = None
+
+    def Session(self):
+        return self
+
+    def get(self, url, params = None):
+        if "consumption" not in url:
+            return FakeResponse({"count": len(self.tariffs), "next": None, "results": self.tariffs})
+        results = [{"consumption": c, "interval_start": f"{d}T00:00:00Z"} for d, c in zip(self.daily.index.strftime("%Y-%m-%d"), self.daily["consumption"])]
+        return FakeResponse({"count": len(results), "next": None, "results": results})
+
+meter_ids = itertools.count()
+
+# (setup, run) for each benchmark, where setup is untimed and returns the arguments for run
+def cases(years, parameters):
+    daily = history(years)
+    yesterday = daily.index[-1].strftime("%Y-%m-%d")
+    fx.requests = FakeRequests(daily)
+    fx.get_cost_data.cache_clear()
+    standing_cost = fx.get_cost_data("gas", "standing")
+    unit_cost = fx.get_cost_data("gas", "unit")
+
+    # a new meter each time so the consumption goes through the API rather than the cache
+    def new_meter():
+        return ({"key": "benchmark", "gas_point": "0", "gas_meter": f"meter-{next(meter_ids)}"}, standing_cost, unit_cost)
+
+    gas = fx.get_daily_gas_data(*new_meter())
+    climate = pd.merge(gas, daily[["tavg"]], left_index = True, right_index = True)
+    typical_gas = fx.get_typical_gas(parameters, 70, 2, 10, "overall")
+    recent = dd.compare_years(climate, yesterday)
+    baseline = climate[climate["tavg"] < 17.5]
+
+    def cold_typical_gas():
+        fx.cached_typical_gas.cache_clear()
+        fx.typical_gas_basis.cache_clear()
+        fx.typical_gas_table.cache_clear()
+        return (parameters, 70, 2, 10, "overall")
+
+    def cold_typical_gas_bands():
+        uncertainty.cached_typical_gas_bands.cache_clear()
+        uncertainty.typical_gas_samples.cache_clear()
+        uncertainty.parameter_samples.cache_clear()
+        return (parameters, 70, 2, 10, "heating")
+
+    def cold_bench_fig():
+        fx.bench_bands.cache_clear()
+        return (12000.0, 3000.0, gas["consumption"].tail(365).sum(), "gas")
+
+    return {
+        "get_daily_gas_data": (new_meter, fx.get_daily_gas_data),
+        "pivot_to_season[overall]": (lambda: (gas, "overall", 10), fx.pivot_to_season),
+        "pivot_to_season[heating]": (lambda: (gas, "heating", 10), fx.pivot_to_season),
+        "get_typical_gas": (cold_typical_gas, fx.get_typical_gas),
+        "get_typical_gas_bands": (cold_typical_gas_bands, uncertainty.get_typical_gas_bands),
+        "get_typical_gas_cost": (lambda: (typical_gas, gas), fx.get_typical_gas_cost),
+        "compare_years": (lambda: (climate, yesterday), dd.compare_years),
+        "expected_from_temperature": (lambda: (recent["tavg"].tolist(), baseline["tavg"], baseline["consumption"]), dd.expected_from_temperature),
+        "fit_changepoint": (lambda: (climate["tavg"], climate["consumption"]), dd.fit_changepoint),
+        "bench_fig": (cold_bench_fig, fx.bench_fig)
+    }
+
+def measure(setup, run, repeat):
+    seconds = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": statistics.median(seconds), "peak_mb": peak / 2**20}
+
+def run_benchmarks(years = history_years, only = None, repeat = 5):
+    parameters = fx.load_models()
+    requests = fx.requests
+    cache_dir = cache.cache_dir
+    results = {}
+    with tempfile.TemporaryDirectory() as temp:
+        cache.cache_dir = Path(temp)
+        try:
+            for y in years:
+                for name, (setup, run) in cases(y, parameters).items():
+                    if only is None or name.startswith(only):
+                        results[f"{name}[{y}y]"] = measure(setup, run, repeat)
+        finally:
+            fx.requests = requests
+            cache.cache_dir = cache_dir
+            fx.get_cost_data.cache_clear()
+    return results
+
+# names of the benchmarks that are slower or use more memory than the baseline by more than the tolerance,
+# ignoring differences under a millisecond or a megabyte which are mostly noise
+def regressions(results, baseline, tolerance = 0.5, memory_tolerance = 0.2):
+    slower = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance) and result["seconds"] - base["seconds"] > 0.001:
+            slower.append(name)
+        elif result["peak_mb"] > base["peak_mb"] * (1 + memory_tolerance) and result["peak_mb"] - base["peak_mb"] > 1:
+            slower.append(name)
+    return slower
+
+def report(results, baseline):
+    print(f"{'benchmark':<36}{'ms':>10}{'peak MB':>10}{'baseline ms':>13}{'change':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = f"{result['seconds'] / base['seconds'] - 1:+.0%}" if base else ""
+        base_ms = f"{base['seconds'] * 1000:.2f}" if base else ""
+        print(f"{name:<36}{result['seconds'] * 1000:>10.2f}{result['peak_mb']:>10.2f}{base_ms:>13}{change:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the hot paths in functions.py")
+    parser.add_argument("--save", action = "store_true", help = "save the results as the baseline")
+    parser.add_argument("--only", default = None, help = "only run the benchmarks starting with this")
+    parser.add_argument("--years", type = int, nargs = "+", default = history_years)
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--tolerance", type = float, default = 0.5, help = "allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--memory-tolerance", type = float, default = 0.2, help = "allowed increase in peak memory as a fraction of the baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.years, args.only, args.repeat)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    report(results, baseline)
+    if args.save:
+        baseline_path.write_text(json.dumps({**baseline, **results}, indent = 2, sort_keys = True) + "\n")
+        print(f"saved to {baseline_path.name}")
+        sys.exit(0)
+    slower = regressions(results, baseline, args.tolerance, args.memory_tolerance)
+    if slower:
+        print(f"regressions: {', '.join(slower)}")
+    sys.exit(1 if slower else 0)
@@ -0,0 +1,11 @@
+# prebuild the cached data files so the first session after a deploy doesn't pay for them
+# python build.py
+
+import cache
+import functions as fx
+
+fx.build_serl_cache()
+cache.theme_dependency("cerulean")
+parameters = fx.load_models()
+for model_type in ("overall", "heating"):
+  fx.typical_gas_table(tuple(parameters["gas_from_day_popt"]), model_type)
@@ -0,0 +1,320 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import metrics
+
+cache_dir = Path(os.getenv("GASBENCH_CACHE_DIR", Path(__file__).parent / "data_cache"))
+
+octopus_schema = """
+create table if not exists tariff (
+  product text, tariff text, charge text, payment_method text,
+  valid_from text, valid_to text, value_exc_vat real, value_inc_vat real,
+  primary key (product, tariff, charge, payment_method, valid_from)
+);
+create table if not exists consumption (
+  gas_point text, gas_meter text, interval_start text, consumption real,
+  primary key (gas_point, gas_meter, interval_start)
+);
+create table if not exists interval (
+  gas_point text, gas_meter text, interval_start text, kwh real,
+  primary key (gas_point, gas_meter, interval_start)
+);
+create table if not exists refresh (
+  key text primary key, period_to text
+);
+"""
+
+def octopus_db():
+  cache_dir.mkdir(parents = True, exist_ok = True)
+  con = sqlite3.connect(cache_dir / "octopus.sqlite", timeout = 30)
+  con.executescript(octopus_schema)
+  return con
+
+# the period_to of the last successful fetch for a key, used to skip fetching twice a day
+def last_refresh(key, connect = octopus_db):
+  with closing(connect()) as con:
+    row = con.execute("select period_to from refresh where key = ?", (key,)).fetchone()
+  return row[0] if row else None
+
+def set_refresh(key, period_to, connect = octopus_db):
+  with closing(connect()) as con, con:
+    con.execute("insert or replace into refresh values (?, ?)", (key, period_to))
+
+def latest_tariff_start(product, tariff, charge):
+  with closing(octopus_db()) as con:
+    row = con.execute("select max(valid_from) from tariff where product = ? and tariff = ? and charge = ?", (product, tariff, charge)).fetchone()
+  return row[0]
+
+def store_tariff(product, tariff, charge, results):
+  rows = [(product, tariff, charge, r["payment_method"], r["valid_from"], r["valid_to"], r["value_exc_vat"], r["value_inc_vat"]) for r in results]
+  with closing(octopus_db()) as con, con:
+    con.executemany("insert or replace into tariff values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+def read_tariff(product, tariff, charge):
+  with closing(octopus_db()) as con:
+    return pd.read_sql_query("select value_exc_vat, value_inc_vat, valid_from, valid_to, payment_method from tariff where product = ? and tariff = ? and charge = ? order by valid_from",
+      con, params = (product, tariff, charge))
+
+def latest_consumption_day(gas_point, gas_meter):
+  with closing(octopus_db()) as con:
+    row = con.execute("select max(interval_start) from consumption where gas_point = ? and gas_meter = ?", (gas_point, gas_meter)).fetchone()
+  return row[0]
+
+# interval_start as YYYY-MM-DD strings and consumption in m3
+def store_consumption(gas_point, gas_meter, interval_start, consumption):
+  rows = [(gas_point, gas_meter, d, float(c)) for d, c in zip(interval_start, consumption)]
+  with closing(octopus_db()) as con, con:
+    con.executemany("insert or replace into consumption values (?, ?, ?, ?)", rows)
+
+def read_consumption(gas_point, gas_meter):
+  with closing(octopus_db()) as con:
+    return pd.read_sql_query("select consumption, interval_start from consumption where gas_point = ? and gas_meter = ? order by interval_start",
+      con, params = (gas_point, gas_meter))
+
+def latest_interval(gas_point, gas_meter):
+  with closing(octopus_db()) as con:
+    row = con.execute("select max(interval_start) from interval where gas_point = ? and gas_meter = ?", (gas_point, gas_meter)).fetchone()
+  return row[0]
+
+# half-hourly readings with interval_start as datetime64[m] in UTC and consumption in kWh
+def store_intervals(gas_point, gas_meter, interval_start, kwh):
+  rows = [(gas_point, gas_meter, d, float(k)) for d, k in zip(np.asarray(interval_start, dtype = "datetime64[m]").astype(str), kwh)]
+  with closing(octopus_db()) as con, con:
+    con.executemany("insert or replace into interval values (?, ?, ?, ?)", rows)
+
+def read_intervals(gas_point, gas_meter):
+  with closing(octopus_db()) as con:
+    rows = con.execute("select interval_start, kwh from interval where gas_point = ? and gas_meter = ? order by interval_start", (gas_point, gas_meter)).fetchall()
+  interval_start = np.array([r[0] for r in rows], dtype = "datetime64[m]")
+  return interval_start, np.array([r[1] for r in rows], dtype = np.float32)
+
+weather_columns = ["tavg", "tmin", "tmax", "prcp", "snow", "wdir", "wspd", "wpgt", "pres", "tsun"]
+
+weather_schema = f"""
+create table if not exists postcode (
+  postcode text primary key, latitude real, longitude real
+);
+create table if not exists station (
+  latitude real, longitude real, station text,
+  primary key (latitude, longitude)
+);
+create table if not exists weather (
+  station text, date text, {", ".join(f"{c} real" for c in weather_columns)},
+  primary key (station, date)
+);
+create table if not exists refresh (
+  key text primary key, period_to text
+);
+"""
+
+# daily weather by station shared by every household near it, with the postcode and station lookups that lead to it
+def weather_db():
+  cache_dir.mkdir(parents = True, exist_ok = True)
+  con = sqlite3.connect(cache_dir / "weather.sqlite", timeout = 30)
+  con.executescript(weather_schema)
+  return con
+
+def read_postcode(postcode):
+  with closing(weather_db()) as con:
+    return con.execute("select latitude, longitude from postcode where postcode = ?", (postcode,)).fetchone()
+
+def store_postcode(postcode, latitude, longitude):
+  with closing(weather_db()) as con, con:
+    con.execute("insert or replace into postcode values (?, ?, ?)", (postcode, latitude, longitude))
+
+def read_station(latitude, longitude):
+  with closing(weather_db()) as con:
+    row = con.execute("select station from station where latitude = ? and longitude = ?", (latitude, longitude)).fetchone()
+  return row[0] if row else None
+
+def store_station(latitude, longitude, station):
+  with closing(weather_db()) as con, con:
+    con.execute("insert or replace into station values (?, ?, ?)", (latitude, longitude, station))
+
+def weather_days(station):
+  with closing(weather_db()) as con:
+    return con.execute("select min(date), max(date) from weather where station = ?", (station,)).fetchone()
+
+# df indexed by date with any of the weather columns, as returned by meteostat
+def store_weather(station, df):
+  df = df.reindex(columns = weather_columns).astype(float)
+  rows = [(station, d, *(None if np.isnan(v) else v for v in values)) for d, values in zip(df.index.strftime("%Y-%m-%d"), df.to_numpy())]
+  with closing(weather_db()) as con, con:
+    con.executemany(f"insert or replace into weather values (?, ?, {', '.join('?' * len(weather_columns))})", rows)
+  return len(rows)
+
+def read_weather(station, start_date, end_date):
+  with closing(weather_db()) as con:
+    df = pd.read_sql_query(f"select date, {', '.join(weather_columns)} from weather where station = ? and date between ? and ? order by date",
+      con, params = (station, start_date, end_date), dtype = dict.fromkeys(weather_columns, "float64"))
+  df["time"] = pd.to_datetime(df.pop("date"))
+  return df.set_index("time")
+
+
+@functools.lru_cache(maxsize = 16)
+def stat_hash(path, mtime, size):
+  return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+# the hash of a file is only recomputed when its modification time or size changes
+def file_hash(path):
+  stat = Path(path).stat()
+  return stat_hash(str(path), stat.st_mtime_ns, stat.st_size)
+
+# every sheet of a workbook parsed once and pickled with the hash of the workbook it came from,
+# written to a temporary file and renamed into place so another process never reads part of it
+def build_serl_cache(workbook):
+  sheets = pd.read_excel(workbook, sheet_name = None, skiprows = 1)
+  cache_dir.mkdir(parents = True, exist_ok = True)
+  path = cache_dir / f"{Path(workbook).stem}.pkl"
+  temp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+  pd.to_pickle({"hash": file_hash(workbook), "sheets": sheets}, temp)
+  temp.replace(path)
+  return sheets
+
+def read_serl_sheet(workbook, sheet):
+  path = cache_dir / f"{Path(workbook).stem}.pkl"
+  if path.exists():
+    cached = pd.read_pickle(path)
+    if cached["hash"] == file_hash(workbook):
+      metrics.cache_hit("serl", True)
+      return cached["sheets"][sheet]
+  metrics.cache_hit("serl", False)
+  return build_serl_cache(workbook)[sheet]
+
+# compiling a theme's Sass takes about half a second, so it is done once per shiny version
+# and kept in the cache rather than repeated by every worker as it starts
+def theme_dependency(preset):
+  from htmltools import HTMLDependency
+  from shiny import __version__, ui
+  path = cache_dir / "theme" / f"{preset}-{__version__}" / "bootstrap.min.css"
+  if not path.exists():
+    path.parent.mkdir(parents = True, exist_ok = True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    temp.write_text(ui.Theme(preset).to_css())
+    temp.replace(path)
+  return HTMLDependency(f"shiny-theme-{preset}", __version__, source = {"subdir": str(path.parent)},
+    stylesheet = {"href": path.name, "data-shiny-theme": preset}, all_files = False)
+
+# an array built once and saved under the cache directory, then memory-mapped read-only
+# so that every process using it shares the same pages
+def mapped_array(name, build):
+  path = cache_dir / f"{name}.npy"
+  if not path.exists():
+    path.parent.mkdir(parents = True, exist_ok = True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temp, "wb") as f:
+      np.save(f, build())
+    temp.replace(path)
+  return np.load(path, mmap_mode = "r")
+
+# frames shared between worker processes, saved as one .npy file of the columns of each dtype and memory-mapped
+# read-only so a host holds one copy of each household's data however many workers read it. keys include the
+# date range so old frames are never read again and are removed after frames_max_age seconds
+frames_max_age = 2 * 86400
+
+def frame_key(*parts):
+  return hashlib.sha256("/".join(map(str, parts)).encode()).hexdigest()[:32]
+
+def load_frame(path):
+  try:
+    layout = json.loads((path / "layout.json").read_text())
+    # plain arrays on the mapped memory, as memmap results of arithmetic would keep pointing at the files
+    index = pd.Index(np.asarray(np.load(path / "index.npy", mmap_mode = "r")), name = layout["index"])
+    blocks = [np.asarray(np.load(path / f"{i}.npy", mmap_mode = "r")) for i in range(len(layout["groups"]))]
+  except FileNotFoundError:
+    return None
+  if len(blocks) == 1:
+    return pd.DataFrame(blocks[0].T, index = index, columns = layout["columns"], copy = False)
+  columns = {layout["columns"][i]: values for block, group in zip(blocks, layout["groups"]) for i, values in zip(group, block)}
+  return pd.DataFrame(columns, index = index, columns = layout["columns"], copy = False)
+
+def read_frame(kind, key):
+  df = load_frame(cache_dir / "frames" / kind / key)
+  metrics.cache_hit(f"frames/{kind}", df is not None)
+  return df
+
+# written to a temporary directory and renamed into place so readers never see part of a frame,
+# returns the shared copy for the caller to use in place of df
+def store_frame(kind, key, df):
+  path = cache_dir / "frames" / kind / key
+  groups = {}
+  for i, dtype in enumerate(df.dtypes):
+    if dtype.hasobject:
+      raise TypeError(f"{kind} frames can only have numeric and datetime columns, {df.columns[i]} is {dtype}")
+    groups.setdefault(dtype.str, []).append(i)
+  if not path.exists():
+    temp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    temp.mkdir(parents = True)
+    np.save(temp / "index.npy", df.index.to_numpy())
+    for i, group in enumerate(groups.values()):
+      np.save(temp / f"{i}.npy", np.stack([df.iloc[:, j].to_numpy() for j in group]))
+    (temp / "layout.json").write_text(json.dumps({"index": df.index.name, "columns": list(df.columns), "groups": list(groups.values())}))
+    try:
+      temp.rename(path)
+    except OSError:
+      # another process stored the same frame first
+      shutil.rmtree(temp, ignore_errors = True)
+    prune_frames(kind)
+  shared = load_frame(path)
+  return df if shared is None else shared
+
+# deleting a frame is safe while other processes have it mapped as the files stay until they unmap them
+def prune_frames(kind, max_age = frames_max_age):
+  cutoff = time.time() - max_age
+  for entry in os.scandir(cache_dir / "frames" / kind):
+    if entry.stat().st_mtime < cutoff:
+      shutil.rmtree(entry.path, ignore_errors = True)
+
+
+# process-wide cache shared by every session, where concurrent callers for the same
+# arguments wait for a single in-flight call rather than each calling func
+def ttl_cache(ttl):
+  def decorator(func):
+    lock = threading.Lock()
+    entries = {}
+    in_flight = {}
+
+    @functools.wraps(func)
+    def wrapper(*args):
+      while True:
+        with lock:
+          entry = entries.get(args)
+          if entry is not None and entry[0] > time.monotonic():
+            metrics.cache_hit(func.__name__, True)
+            return entry[1]
+          event = in_flight.get(args)
+          leader = event is None
+          if leader:
+            event = in_flight[args] = threading.Event()
+        if not leader:
+          # if the leader fails the next waiter retries the call
+          event.wait()
+          continue
+        metrics.cache_hit(func.__name__, False)
+        try:
+          value = func(*args)
+          with lock:
+            entries[args] = (time.monotonic() + ttl, value)
+          return value
+        finally:
+          with lock:
+            del in_flight[args]
+          event.set()
+
+    def cache_clear():
+      with lock:
+        entries.clear()
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+  return decorator
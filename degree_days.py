@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# mean daily temperature above which homes are assumed not to be heated
+heating_threshold = 17.5
+
+# the same window of days up to the month and day of yesterday in every year of df, as one selection.
+# a 29th of February ends on the 28th in other years
+def compare_years(df, yesterday, days = 30):
+  end = pd.Timestamp(yesterday)
+  years = df.index.year.unique()
+  ends = pd.DatetimeIndex(sorted(end - pd.DateOffset(years = end.year - year) for year in years))
+  # the window each day could be in is the one ending next, which may be in the following year
+  position = ends.searchsorted(df.index)
+  window_end = ends[np.minimum(position, len(ends) - 1)]
+  mask = (position < len(ends)) & (df.index >= window_end - pd.Timedelta(days = days))
+  return df[mask].copy()
+
+# a straight line fitted to the use on days below the threshold, with the lowest use above it
+def expected_from_temperature(temperatures, baseline_temp, baseline_values):
+  x = np.asarray(baseline_temp, dtype = float)
+  y = np.asarray(baseline_values, dtype = float)
+  x_centred = x - x.mean()
+  slope = (x_centred @ (y - y.mean())) / (x_centred @ x_centred)
+  intercept = y.mean() - (slope * x.mean())
+  temperatures = np.asarray(temperatures, dtype = float)
+  return np.where(temperatures >= heating_threshold, y.min(), intercept + (slope * temperatures))
+
+# use that doesn't respond to temperature, for when there is nothing to fit a slope to
+def flat_fit(values):
+  return {
+    "base_temperature": np.nan,
+    "slope": 0.0,
+    "baseload": float(values.mean()) if len(values) else np.nan,
+    "r_squared": 0.0,
+    "n": int(len(values))
+  }
+
+# fit use = baseload + slope * max(base - temperature, 0) by least squares for every candidate base temperature
+# at once and keep the best, so the temperature the heating comes on at is found rather than assumed
+def fit_changepoint(temperatures, values, bases = np.round(np.arange(10, 22.05, 0.1), 1)):
+  t = np.asarray(temperatures, dtype = float)
+  y = np.asarray(values, dtype = float)
+  keep = np.isfinite(t) & np.isfinite(y)
+  t, y = t[keep], y[keep]
+  if len(y) == 0:
+    return flat_fit(y)
+  degree_days = np.clip(bases[:, None] - t, 0, None)
+  # the degree days only vary for bases above the coldest day, and then only if the temperature varies
+  varies = (bases > t.min()) & (t.max() > t.min())
+  dd_centred = degree_days - degree_days.mean(axis = 1, keepdims = True)
+  y_centred = y - y.mean()
+  s_dy = dd_centred @ y_centred
+  s_dd = np.einsum("ij,ij->i", dd_centred, dd_centred)
+  s_yy = y_centred @ y_centred
+  if s_yy == 0 or not varies.any():
+    return flat_fit(y)
+  with np.errstate(divide = "ignore", invalid = "ignore"):
+    sse = np.where(varies, s_yy - (s_dy ** 2 / s_dd), np.inf)
+  best = np.argmin(sse)
+  slope = s_dy[best] / s_dd[best]
+  return {
+    "base_temperature": float(bases[best]),
+    "slope": float(slope),
+    "baseload": float(y.mean() - (slope * degree_days[best].mean())),
+    "r_squared": float(1 - (sse[best] / s_yy)),
+    "n": int(len(y))
+  }
+
+def degree_day_response(temperatures, fit):
+  temperatures = np.asarray(temperatures, dtype = float)
+  if fit["slope"] == 0:
+    return np.full(temperatures.shape, fit["baseload"])
+  degree_days = np.clip(fit["base_temperature"] - temperatures, 0, None)
+  return fit["baseload"] + (fit["slope"] * degree_days)
@@ -1,72 +1,179 @@
-import plotly.graph_objects as go
+import asyncio
+import contextvars
 import datetime
+import functools
+import hashlib
+import json
 import requests
 import pandas as pd
 import numpy as np
-import scipy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import intervals
+import metrics
+
+octopus_url = os.getenv("OCTOPUS_API_URL", "https://api.octopus.energy/v1")
+# serve the weather from the store without topping it up from meteostat
+weather_offline = bool(os.getenv("GASBENCH_OFFLINE"))
 
 
 m3_per_kwh = 19.3 / 212.8
 typical_cooking = [i * m3_per_kwh for i in [66, 90, 88, 99, 105, 110, 115, 120, 125, 130, 135]]
 
 month_list = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-month_days = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 
 def gen_log_model(x, b, c, m, t):
 	return (c / (1 + t * np.exp(-b*(x-m)))**1/t )
 
+# gen_log_model only depends on b, c / t and m + log(t) / b, so it is this logistic with k = c / t and m + log(t) / b as m
+def logistic_model(x, b, k, m):
+	return (k / (1 + np.exp(-b*(x-m))))
+
 def pow_model(x, a, b):
 	return (a * x**b)
 
 def exp_model(x,a,b,c):
 	return (a * (1-b * np.exp(-c*x)))
 
+# fitted model parameters from models.py, loaded once per process and shared so must not be modified
+@metrics.watch_cache
+@functools.lru_cache(maxsize = None)
+def load_models(path = "fitted_models.json"):
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact["schema"] != 1:
+        raise ValueError(f"{path} has model schema {artifact['schema']}, expected 1")
+    parameters = {}
+    for name, model in artifact["models"].items():
+        parameters[f"{name}_popt"] = np.array(model["popt"])
+        parameters[f"{name}_pcov"] = np.array(model["pcov"])
+    return parameters
+
+serl_workbooks = {1: "SERL Stats Report (volume 1) - Tabular data v03b Final.xlsx", 2: "SERL_Stats_Report_Aggregated_Tables_Vol_2.xlsx"}
+
+# read from the cached copy of the workbook, which is rebuilt whenever the workbook changes
 def get_serl_data(version, figure):
-    if version == 1:
-        df = pd.read_excel("SERL Stats Report (volume 1) - Tabular data v03b Final.xlsx", sheet_name = figure, skiprows = 1)
-    if version == 2:
-        df = pd.read_excel("SERL_Stats_Report_Aggregated_Tables_Vol_2.xlsx", sheet_name = figure, skiprows = 1)
-    return df
+    return cache.read_serl_sheet(serl_workbooks[version], figure)
 
-def get_typical_gas(parameters, floor_area, occupants, start_month, model_type):
+def build_serl_cache():
+    for workbook in serl_workbooks.values():
+        cache.build_serl_cache(workbook)
+
+#conversion factors for energy use required to heat water in different months
+water_heating = np.array([1.1, 1.06, 1.02, 0.98, 0.94, 0.9, 0.9, 0.94, 0.98, 1.02, 1.06, 1.1])
+typical_dates = pd.date_range("2023-06-30", "2024-06-30")
+
+# floor area and occupancy only scale the typical curve, so this is the only part that depends on them.
+# broadcasts over arrays of households or of parameter samples
+def typical_gas_scale(parameters, floor_area, occupants):
 	expected_occup = exp_model(floor_area, *parameters["occup_from_area_popt"])
-	expected_area = exp_model(np.array([occupants, expected_occup]), *parameters["area_from_occup_popt"])
-	occupancy_scaling_factor = expected_area[0] / expected_area[1]
+	occupancy_scaling_factor = exp_model(occupants, *parameters["area_from_occup_popt"]) / exp_model(expected_occup, *parameters["area_from_occup_popt"])
+	return pow_model(floor_area, *parameters["total_from_area_popt"]) * occupancy_scaling_factor
 
-	pdf = pd.DataFrame({"t":np.arange(0, 367), "date":pd.date_range("2023-06-30", "2024-06-30")})
-	pdf["cum"] = gen_log_model(pdf["t"], *parameters["gas_from_day_popt"]) * pow_model(floor_area, *parameters["total_from_area_popt"]) * occupancy_scaling_factor
-	pdf["daily"] = pdf["cum"].diff()
-	pdf = pdf.dropna()
+# day of the model (t) that each month starts on, the model running from the 1st of July
+month_start_t = np.array([np.flatnonzero((typical_dates[1:].month == m) & (typical_dates[1:].day == 1))[0] + 1 for m in range(1, 13)])
+
+# daily use per unit of scale on each day of the model, or a row for each set of parameters
+# when they are columns of samples
+def typical_gas_daily(gas_from_day_popt, model_type):
+	months = typical_dates[1:].month.to_numpy()
+	daily = np.diff(gen_log_model(np.arange(0, 367), *gas_from_day_popt))
 
 	if model_type == "heating":
-		#conversion factors for energy use required to heat water in different months
-		mdf = pd.DataFrame({"water": [1.1, 1.06, 1.02, 0.98, 0.94, 0.9, 0.9, 0.94, 0.98, 1.02, 1.06, 1.1], "month": np.arange(1, 13)})
-		mdf["adjust"] = mdf["water"]/ mdf.loc[(mdf["month"] >= 6) & (mdf["month"] <= 8), "water"].mean() 
-		pdf["month"] = pdf["date"].dt.month
-		pdf = pdf.merge(mdf)
-		not_heat = pdf.loc[(pdf["month"] >= 6) & (pdf["month"] <= 8), "daily"].mean() 
-		pdf["daily"] = pdf["daily"] - (pdf["adjust"] * not_heat)
-		pdf["daily"] = pdf["daily"].clip(lower = 0)
-
-	start_date = min(pdf.loc[pdf["date"].dt.month == start_month, "date"])
-	pdf["date"] = np.where(pdf["date"] < start_date, pdf["date"] + pd.DateOffset(days = 365), pdf["date"])
-	pdf = pdf.sort_values(by = "date")
-	pdf["cum"] = pdf.daily.cumsum()
-	return pdf
+		adjust = water_heating / water_heating[5:8].mean()
+		summer = (months >= 6) & (months <= 8)
+		not_heat = daily[..., summer].mean(axis = -1, keepdims = True)
+		daily = (daily - (adjust[months - 1] * not_heat)).clip(min = 0)
+	return daily
+
+# bump when typical_gas_daily or the layout of the table changes so stale tables in the cache aren't read
+typical_gas_table_version = 1
+
+# daily use per unit of scale in season order for a season starting in each month (12 x 366 float32),
+# built once per fitted curve and memory-mapped so every worker process shares the same pages.
+# the file is keyed by everything the build uses
+@functools.lru_cache(maxsize = None)
+def typical_gas_table(gas_from_day_popt, model_type):
+	inputs = [np.array(gas_from_day_popt, dtype = float), water_heating, month_start_t.astype(np.int64)]
+	key = hashlib.sha256(b"".join(a.tobytes() for a in inputs) + f"{model_type}/{typical_gas_table_version}".encode()).hexdigest()[:16]
+	def build():
+		daily = typical_gas_daily(gas_from_day_popt, model_type)
+		return np.stack([np.roll(daily, 1 - start) for start in month_start_t]).astype(np.float32)
+	return cache.mapped_array(f"typical_gas/{model_type}-{key}", build)
+
+# the day of the model (t) of each day of a season starting on the 1st of start_month
+def season_t(start_month):
+	return np.roll(np.arange(1, 367), 1 - month_start_t[start_month - 1])
+
+# daily use per unit of scale in season order, along with the day of the model (t) and date of each value,
+# dated to match the index of the season pivots
+@metrics.watch_cache
+@functools.lru_cache(maxsize = 64)
+def typical_gas_basis(gas_from_day_popt, start_month, model_type):
+	t = season_t(start_month)
+	dates = pd.date_range(f"2023-{start_month:02d}-01", periods = 366).to_numpy()
+	basis = {"t": t, "date": dates, "daily": typical_gas_table(gas_from_day_popt, model_type)[start_month - 1]}
+	for v in basis.values():
+		v.setflags(write = False)
+	return basis
+
+def scale_typical_gas(basis, scale):
+	daily = np.multiply(basis["daily"], scale, dtype = float)
+	return daily, np.cumsum(daily)
+
+def parameters_key(parameters):
+	return tuple((k, tuple(v)) for k, v in sorted(parameters.items()) if k.endswith("_popt"))
+
+# shared by every session in the process, cache_info() gives the hit and miss counts
+@metrics.watch_cache
+@functools.lru_cache(maxsize = int(os.getenv("TYPICAL_GAS_CACHE_SIZE", 4096)))
+def cached_typical_gas(parameters_key, floor_area, occupants, start_month, model_type):
+	parameters = dict(parameters_key)
+	basis = typical_gas_basis(parameters["gas_from_day_popt"], start_month, model_type)
+	daily, cum = scale_typical_gas(basis, typical_gas_scale(parameters, floor_area, occupants))
+	daily.setflags(write = False)
+	cum.setflags(write = False)
+	return pd.DataFrame({"t": basis["t"], "date": basis["date"], "cum": cum, "daily": daily}, index = basis["t"], copy = False)
+
+# each caller gets a shallow copy so adding columns can't leak into the cache and the values themselves are read-only
+def get_typical_gas(parameters, floor_area, occupants, start_month, model_type):
+	return cached_typical_gas(parameters_key(parameters), floor_area, occupants, start_month, model_type).copy(deep = False)
+
+# maps the daily use of every start month and model type at startup. each typical curve is then one multiply of a
+# mapped row, so the curves themselves are left to be cached as sessions ask for them
+def warm_typical_gas(parameters, start_months = range(1, 13), model_types = ("overall", "heating")):
+	for start_month in start_months:
+		for model_type in model_types:
+			typical_gas_basis(tuple(parameters["gas_from_day_popt"]), start_month, model_type)
 
 
+# shared across sessions so each worker fetches the tariffs at most once an hour, callers must not modify the result
+@cache.ttl_cache(3600)
 def get_cost_data(fuel, charge):
   if fuel == "gas":
-    base_url = "https://api.octopus.energy/v1/products/VAR-22-11-01/gas-tariffs/G-1R-VAR-22-11-01-A/"
+    product = "VAR-22-11-01"
+    tariff = f"G-1R-{product}-A"
+    base_url = f"{octopus_url}/products/{product}/gas-tariffs/{tariff}/"
   if charge == "standing":
     url = f"{base_url}standing-charges/"
   if charge == "unit":
     url = f"{base_url}standard-unit-rates/"
   yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
-  payload = {"period_from":"2020-10-31T00:00Z","period_to" : yesterday}
-  req = requests.get(url=url, params = payload).json()
-  df = pd.json_normalize(req["results"])
+  refresh_key = f"tariff/{product}/{tariff}/{charge}"
+  fresh = cache.last_refresh(refresh_key) == yesterday
+  metrics.cache_hit("octopus_tariff", fresh)
+  if not fresh:
+    # refetch from the latest cached period as it may have been closed since
+    period_from = cache.latest_tariff_start(product, tariff, charge) or "2020-10-31T00:00Z"
+    payload = {"period_from": period_from, "period_to" : yesterday}
+    with metrics.timer("external", f"octopus/{charge}"):
+      req = requests.get(url=url, params = payload).json()
+    cache.store_tariff(product, tariff, charge, req["results"])
+    cache.set_refresh(refresh_key, yesterday)
+  df = cache.read_tariff(product, tariff, charge)
   df = df[df["payment_method"] == "DIRECT_DEBIT"]
   df = df.drop(["value_exc_vat", "payment_method"], axis = 1)
   df.columns = [charge, "start_date", "end_date"]
@@ -82,149 +189,436 @@ def get_cost_data(fuel, charge):
   df = df.drop(to_drop, axis = 1)
   return df
 
-# fetch daily gas use and return with datetime, kwh and cost conversions
-def get_daily_gas_data(octopus_secrets, standing_cost, unit_cost):
+# sum the charges of every tariff period covering each date (periods are closed at both ends)
+def lookup_tariff(dates, tariff, charge):
+  dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype = "datetime64[ns]")
+  tariff = tariff.dropna(subset = ["start_date", "end_date"])
+  starts = pd.to_datetime(tariff["start_date"]).to_numpy(dtype = "datetime64[ns]")
+  ends = pd.to_datetime(tariff["end_date"]).to_numpy(dtype = "datetime64[ns]") + np.timedelta64(1, "ns")
+  values = np.nan_to_num(tariff[charge].to_numpy(dtype = float))
+  # the total charge is constant between consecutive period boundaries
+  bounds = np.unique(np.concatenate([starts, ends]))
+  covering = (starts <= bounds[:, None]) & (ends > bounds[:, None])
+  segment_values = np.append((covering * values).sum(axis = 1), 0)
+  return segment_values[np.searchsorted(bounds, dates, side = "right") - 1]
+
+def consumption_page(results, group_by):
+  consumption = np.array([r["consumption"] for r in results], dtype = float)
+  if group_by == "day":
+    # the date part is the local day the readings were grouped by
+    interval_start = np.array([r["interval_start"][:10] for r in results], dtype = "datetime64[D]")
+  else:
+    interval_start = pd.to_datetime([r["interval_start"] for r in results], utc = True).tz_localize(None).to_numpy()
+  return interval_start, consumption
+
+# yield the interval starts and consumption of each page of results in turn, following the next links.
+# the next page is fetched while the current one is being used so only two pages are held at once
+def iter_consumption(octopus_secrets, period_from, period_to, group_by = "day", page_size = 25000):
+  gas_point = octopus_secrets["gas_point"]
+  gas_meter = octopus_secrets["gas_meter"]
+  session = requests.Session()
+  session.auth = (octopus_secrets["key"], "")
+  url = f"{octopus_url}/gas-meter-points/{gas_point}/meters/{gas_meter}/consumption/"
+  payload = {"period_from": period_from, "period_to" : period_to, "page_size" : page_size, "order_by" : "period"}
+  if group_by is not None:
+    payload["group_by"] = group_by
+
+  def get_page(url, params):
+    with metrics.timer("external", "octopus/consumption"):
+      return session.get(url = url, params = params).json()
+
+  # the pages are fetched in the caller's context so they are traced with its session
+  context = contextvars.copy_context()
+  with ThreadPoolExecutor(max_workers = 1) as pool:
+    future = pool.submit(context.run, get_page, url, payload)
+    while future is not None:
+      page = future.result()
+      future = pool.submit(context.run, get_page, page["next"], None) if page.get("next") else None
+      yield consumption_page(page["results"], group_by)
+
+# identifies the meter and the key used to read it, or the bundled data when the details aren't all given
+def consumption_identity(octopus_secrets):
+  if [k for k, v in octopus_secrets.items() if not v]:
+    return "demo"
+  key_hash = hashlib.sha256(octopus_secrets["key"].encode()).hexdigest()[:16]
+  return f"consumption/{octopus_secrets['gas_point']}/{octopus_secrets['gas_meter']}/{key_hash}"
+
+# fetch daily gas use in m3
+def get_consumption_data(octopus_secrets):
   
   if [k for k, v in octopus_secrets.items() if not v]:
     df = pd.read_csv("2020-2025_data.csv")
     df.columns = ["index", "interval_start", "consumption"]
+    df["interval_start"] = pd.to_datetime(df["interval_start"])
   else:
     yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
-    payload = {"period_from":"2020-10-31T00:00:00Z", "period_to" : yesterday, "page_size" : 25000, "group_by" : "day","order_by" : "period"}
-    session = requests.Session()
-    session.auth = (octopus_secrets["key"], "")
     gas_point = octopus_secrets["gas_point"]
     gas_meter = octopus_secrets["gas_meter"]
-    daily_gas_req = session.get(url=f"https://api.octopus.energy/v1/gas-meter-points/{gas_point}/meters/{gas_meter}/consumption/", params = payload).json()
-    df = pd.json_normalize(daily_gas_req["results"])
-    df["interval_start"] = pd.to_datetime(df["interval_start"].str.split("T").str[0])
-    df = df.drop([ "interval_end"], axis = 1)
-  
+    # a key that hasn't been used for this meter today must go to the API first so the cache can't be read without access
+    refresh_key = consumption_identity(octopus_secrets)
+    fresh = cache.last_refresh(refresh_key) == yesterday
+    metrics.cache_hit("octopus_consumption", fresh)
+    if not fresh:
+      # the last week is fetched again as readings arrive late and the latest days can be part totals
+      last_day = cache.latest_consumption_day(gas_point, gas_meter)
+      period_from = (pd.to_datetime(last_day) - pd.Timedelta(days = 7)).strftime("%Y-%m-%d") if last_day else "2020-10-31"
+      for interval_start, consumption in iter_consumption(octopus_secrets, f"{period_from}T00:00:00Z", yesterday):
+        cache.store_consumption(gas_point, gas_meter, interval_start.astype(str), consumption)
+      cache.set_refresh(refresh_key, yesterday)
+    df = cache.read_consumption(gas_point, gas_meter)
+    df["interval_start"] = pd.to_datetime(df["interval_start"])
+  return df
+
+# half-hourly gas use up to yesterday from the cached readings, fetching those from a week before the latest cached one
+# once a day as late readings fill in. there is no half-hourly demo data so all of the Octopus details are needed
+def get_cached_interval_data(octopus_secrets):
+  if [k for k, v in octopus_secrets.items() if not v]:
+    raise ValueError("half-hourly gas use needs the Octopus key, gas meter point and gas meter serial")
+  yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
+  gas_point = octopus_secrets["gas_point"]
+  gas_meter = octopus_secrets["gas_meter"]
+  refresh_key = consumption_identity(octopus_secrets).replace("consumption/", "interval/", 1)
+  fresh = cache.last_refresh(refresh_key) == yesterday
+  metrics.cache_hit("octopus_interval", fresh)
+  if not fresh:
+    latest = cache.latest_interval(gas_point, gas_meter)
+    period_from = f"{np.datetime64(latest, 'm') - np.timedelta64(7, 'D')}:00Z" if latest else "2020-10-31T00:00:00Z"
+    for interval_start, consumption in iter_consumption(octopus_secrets, period_from, yesterday, group_by = None):
+      cache.store_intervals(gas_point, gas_meter, interval_start, consumption * (1 / m3_per_kwh))
+    cache.set_refresh(refresh_key, yesterday)
+  return intervals.IntervalStore(*cache.read_intervals(gas_point, gas_meter))
+
+# add datetime index, kwh and cost conversions to daily gas use
+def price_gas_data(df, standing_cost, unit_cost, units = "m3"):
   df["date"] = df["interval_start"]
   df = df.set_index("date")
   df.index = pd.to_datetime(df.index)
-  df["consumption"] = df["consumption"] * (1 / m3_per_kwh)
-  sc = standing_cost
-  uc = unit_cost
-  uc_idx = pd.IntervalIndex.from_arrays(uc["start_date"], uc["end_date"], closed = "both")
-  sc_idx = pd.IntervalIndex.from_arrays(sc["start_date"], sc["end_date"], closed = "both")
-  df["unit"] = df["interval_start"].apply(lambda x: uc.loc[uc_idx.contains(x), "unit"].sum())
-  df["standing"] = df["interval_start"].apply(lambda x: sc.loc[sc_idx.contains(x), "standing"].sum())
+  if units == "m3":
+    df["consumption"] = df["consumption"] * (1 / m3_per_kwh)
+  df["unit"] = lookup_tariff(df["interval_start"], unit_cost, "unit")
+  df["standing"] = lookup_tariff(df["interval_start"], standing_cost, "standing")
   df["cost"] = ((df["unit"] * df["consumption"]) + df["standing"]) / 100
   return df
 
+# fetch daily gas use and return with datetime, kwh and cost conversions.
+# with half-hourly readings the daily values come from the daily totals of the interval store
+def get_daily_gas_data(octopus_secrets, standing_cost, unit_cost, granularity = "day"):
+  if granularity == "half-hour":
+    df = get_cached_interval_data(octopus_secrets).tier("day")[["consumption", "interval_start"]]
+    return price_gas_data(df, standing_cost, unit_cost, units = "kWh")
+  return price_gas_data(get_consumption_data(octopus_secrets), standing_cost, unit_cost)
+
+# priced daily use for a meter up to yesterday, shared between worker processes under a key of the meter,
+# the date range and the tariffs, so a session on any worker reuses the frame built by the first one
+# the raw daily use is shared under the meter and date range, and the priced use under those and the tariffs,
+# so a change of tariff reprices the shared use rather than fetching it again
+def shared_consumption_data(octopus_secrets):
+  yesterday = (datetime.datetime.today()-datetime.timedelta(1)).strftime("%Y-%m-%d")
+  key = cache.frame_key(consumption_identity(octopus_secrets), "2020-10-31", yesterday)
+  df = cache.read_frame("consumption", key)
+  if df is None:
+    df = cache.store_frame("consumption", key, get_consumption_data(octopus_secrets))
+  return key, df
+
+def shared_priced_gas_data(consumption_key, consumption, standing_cost, unit_cost):
+  tariffs = hashlib.sha256(b"".join(pd.util.hash_pandas_object(df, index = False).to_numpy().tobytes() for df in (standing_cost, unit_cost)))
+  key = cache.frame_key(consumption_key, tariffs.hexdigest())
+  df = cache.read_frame("daily_gas", key)
+  if df is None:
+    df = cache.store_frame("daily_gas", key, price_gas_data(consumption.copy(deep = False), standing_cost, unit_cost))
+  return df
+
+def shared_daily_gas_data(octopus_secrets, standing_cost, unit_cost):
+  return shared_priced_gas_data(*shared_consumption_data(octopus_secrets), standing_cost, unit_cost)
+
+# the daily use and the tariffs are fetched at the same time in worker threads so the event loop isn't blocked,
+# then priced once all three are in
+async def fetch_daily_gas_data(octopus_secrets):
+  (consumption_key, consumption), standing_cost, unit_cost = await asyncio.gather(
+    asyncio.to_thread(shared_consumption_data, octopus_secrets),
+    asyncio.to_thread(get_cost_data, "gas", "standing"),
+    asyncio.to_thread(get_cost_data, "gas", "unit")
+  )
+  return await asyncio.to_thread(shared_priced_gas_data, consumption_key, consumption, standing_cost, unit_cost)
+
+# day of a leap year calendar (0-365) of each date, so the same month and day always line up
+# and the 29th of February only comes up in leap years
+def calendar_day(dates):
+  dates = pd.DatetimeIndex(dates)
+  return dates.dayofyear.to_numpy() - 1 + ((~dates.is_leap_year) & (dates.month > 2))
+
+# typical daily use on each day of the calendar, placed by the day of the model (t) rather than the
+# season ordered date, which is shifted by a year and so a day out after the 29th of February
+def typical_calendar(typical_gas):
+  daily = np.empty(366)
+  daily[calendar_day(typical_dates[typical_gas["t"].to_numpy()])] = typical_gas["daily"].to_numpy()
+  return daily
+
+# what each day would have cost with typical use, priced with the same tariffs as the actual use (£)
 def get_typical_gas_cost(typical_gas, daily_gas):
-  
-  typical_gas['date'] = pd.to_datetime(typical_gas['date'])
-  daily_gas.index = pd.to_datetime(daily_gas.index)  
+  dates = pd.DatetimeIndex(daily_gas.index)
+  typical = typical_calendar(typical_gas)[calendar_day(dates)]
+  return pd.DataFrame({
+    "consumption": daily_gas["consumption"].to_numpy(),
+    "cost": daily_gas["cost"].to_numpy(),
+    "typical": typical,
+    "typical_cost": ((typical * daily_gas["unit"].to_numpy()) + daily_gas["standing"].to_numpy()) / 100
+  }, index = dates)
 
-  typical_gas['month_day'] = typical_gas['date'].dt.strftime('%m-%d')
-  daily_gas['month_day'] = daily_gas.index.strftime('%m-%d')
-  
-  merged = daily_gas.merge(typical_gas[['month_day', 'daily']], on='month_day', how='left')
-  merged['typical_cost'] = (merged['daily'] * merged['unit']) + merged['standing']
-  
-  return merged
+# latitude and longitude of a postcode, looked up once and kept
+def postcode_location(postcode):
+  postcode = postcode.replace(" ", "").upper()
+  location = cache.read_postcode(postcode)
+  metrics.cache_hit("postcode", location is not None)
+  if location is None:
+    with metrics.timer("external", "postcodes.io"):
+      response = requests.get(f"https://api.postcodes.io/postcodes/{postcode}")
+    postcode_data = response.json()
+    location = (postcode_data["result"]["latitude"], postcode_data["result"]["longitude"])
+    cache.store_postcode(postcode, *location)
+  return location
+
+# the nearest station with daily data, looked up once for each location
+def nearest_station(latitude, longitude):
+  from meteostat import Stations
+  station = cache.read_station(latitude, longitude)
+  metrics.cache_hit("station", station is not None)
+  if station is None:
+    with metrics.timer("external", "meteostat/stations"):
+      station = Stations().nearby(latitude, longitude).inventory("daily", True).fetch(1).index[0]
+    cache.store_station(latitude, longitude, station)
+  return station
+
+# fetch the days a station is missing between two dates into the store, at most once a day. the last week is
+# fetched again as the latest days are modelled until the observations come in
+def top_up_weather(station, start_date, end_date):
+  from meteostat import Daily
+  refresh_key = f"weather/{station}"
+  fresh = cache.last_refresh(refresh_key, cache.weather_db) == end_date
+  metrics.cache_hit("weather", fresh)
+  if fresh:
+    return
+  first, last = cache.weather_days(station)
+  if last is None:
+    gaps = [(start_date, end_date)]
+  else:
+    gaps = [(start_date, (pd.to_datetime(first) - pd.Timedelta(days = 1)).strftime("%Y-%m-%d")),
+      ((pd.to_datetime(last) - pd.Timedelta(days = 7)).strftime("%Y-%m-%d"), end_date)]
+  for start, end in gaps:
+    if start <= end:
+      with metrics.timer("external", "meteostat"):
+        df = Daily(station, datetime.datetime.strptime(start, "%Y-%m-%d"), datetime.datetime.strptime(end, "%Y-%m-%d")).fetch()
+      cache.store_weather(station, df)
+  cache.set_refresh(refresh_key, end_date, cache.weather_db)
 
-# fetch min and max temperature data
+# daily weather at the station nearest a postcode, read from the store shared by every household near the station.
+# the frame is shared between worker processes until the station's days or last top up change
 def get_climate_data(postcode, start_date, end_date):
-  from meteostat import Point, Daily
-  from datetime import datetime
+  station = nearest_station(*postcode_location(postcode))
+  if not weather_offline:
+    top_up_weather(station, start_date, end_date)
+  key = cache.frame_key(station, start_date, end_date, *cache.weather_days(station), cache.last_refresh(f"weather/{station}", cache.weather_db))
+  df = cache.read_frame("weather", key)
+  if df is None:
+    df = cache.store_frame("weather", key, cache.read_weather(station, start_date, end_date))
+  return df
 
-  response = requests.get(f"https://api.postcodes.io/postcodes/{postcode}")
-  postcode_data = response.json()
-  latitude = postcode_data["result"]["latitude"]
-  longitude = postcode_data["result"]["longitude"]
 
-  start = datetime.strptime(start_date, "%Y-%m-%d")
-  end = datetime.strptime(end_date, "%Y-%m-%d")
-  
-  location = Point(latitude, longitude, 0)
-  data = Daily(location, start, end)
-  df = data.fetch()
+# season (the year it starts in) and zero-based day of season of each date, for seasons starting on the 1st of start_month
+def season_days(dates, start_month):
+  month_index = dates.astype("datetime64[M]").astype(int)
+  season = 1970 + (month_index - (start_month - 1)) // 12
+  season_start = ((season - 1970) * 12 + start_month - 1).astype("datetime64[M]").astype("datetime64[D]")
+  dos = (dates.astype("datetime64[D]") - season_start).astype(int)
+  return season, dos
 
-  return df
+# remove summer use, assuming the average daily use in summer is the use other than for heating
+def heating_consumption(dates, consumption):
+  months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+  summer = (months >= 6) & (months <= 8)
+  daily_not_heat = np.nanmean(consumption[summer])
+  heating = (consumption - daily_not_heat).clip(min = 0)
+  heating[summer] = 0
+  #need to use conversion factor here...
+  return heating
 
+# day of season x season matrix of cumulative use, with gaps left as nan
+def season_matrix(consumption, season, dos):
+  seasons = np.unique(season)
+  matrix = np.full((366, len(seasons)), np.nan)
+  matrix[dos, np.searchsorted(seasons, season)] = consumption
+  missing = np.isnan(matrix)
+  cumulative = np.add.accumulate(np.where(missing, 0, matrix), axis = 0)
+  cumulative[missing] = np.nan
+  return seasons, cumulative
 
-# convert daily data into cumulative use per heating season
-def pivot_to_season(df, start_month, typical_type, month_offset, month_number):
-  df = df.copy()
-  if typical_type == "heating":
-    df["month"] = pd.to_datetime(df["interval_start"], utc = True).dt.month
-    daily_not_heat = df.loc[(df["month"] >= 6) & (df["month"] <= 8), "consumption"].mean()
-    df["consumption"] = (df["consumption"] - daily_not_heat).clip(lower = 0)
-    df.loc[(df["month"] >= 6) & (df["month"] <= 8), "consumption"] = 0
-    df = df.drop(["month"], axis = 1)
-    #need to use conversion factor here...
-    
-  month_abbrev = month_list[month_list.index(start_month)-1].upper()[0:3]
-  month_filter = "Y-" + month_abbrev
-
-  df["season"] = df.index.to_period(month_filter).year - 1
-  df["dos"] = (df.index - df.index.to_period(month_filter).start_time).days + 1
-  df["cumulative"] = df.groupby(pd.Grouper(freq=month_filter))["consumption"].cumsum()
-  
-  piv = pd.pivot_table(df, index = ["dos"], columns=["season"], values=["cumulative"])
+def label_season_matrix(seasons, cumulative, month_number):
+  pivot_index = pd.date_range(start = "2023-" + "{:02d}".format(month_number) + "-01", periods = 366)
+  piv = pd.DataFrame(cumulative, index = pivot_index, columns = [f"{y}-{y + 1}" for y in seasons])
+  # remove years that start before the data, rather than by zero use which heating has all summer
+  piv = piv.loc[:, ~np.isnan(cumulative[:9]).all(axis = 0)]
   piv = piv.bfill()
-
-  pivot_index = pd.date_range(start="2023-" + "{:02d}".format(month_number)+"-01", end = "2024-" + "{:02d}".format(month_number-1)+"-"+str(month_days[month_number]))
-  year_index = []
-  for y in list(pd.unique(df["season"])):
-      year_index.append(str(y)+"-"+str(y+1))
-  piv.index = pivot_index
-  piv.columns = year_index
-  # remove years that start with zeroes
-  piv = piv.loc[:, ~(piv.diff().iloc[1:10] == 0).all()]
   return piv
 
+# convert daily data into cumulative use per heating season, sharing the season layout between the typical types
+def pivot_to_seasons(df, month_number, typical_types = ("overall", "heating")):
+  dates = pd.to_datetime(df.index).to_numpy(dtype = "datetime64[D]")
+  consumption = df["consumption"].to_numpy(dtype = float)
+  season, dos = season_days(dates, month_number)
+  pivots = {}
+  for typical_type in typical_types:
+    values = heating_consumption(dates, consumption) if typical_type == "heating" else consumption
+    pivots[typical_type] = label_season_matrix(*season_matrix(values, season, dos), month_number)
+  return pivots
+
+def pivot_to_season(df, typical_type, month_number):
+  return pivot_to_seasons(df, month_number, (typical_type,))[typical_type]
+
+
+# identifies a run of daily use by its days and values
+def daily_digest(dates, consumption):
+  return hashlib.sha256(dates.tobytes() + consumption.tobytes()).hexdigest()[:32]
+
+# keeps the season matrix between calls so that a history that grows a day at a time
+# only needs the new days adding to the current season rather than a full rebuild
+class SeasonAccumulator:
+
+  def __init__(self, month_number, typical_type = "overall"):
+    self.month_number = month_number
+    self.typical_type = typical_type
+    self.last_date = None
+    self.digest = None
+    self.current_dos = None
+
+  def update(self, df):
+    all_dates = pd.to_datetime(df.index).to_numpy(dtype = "datetime64[D]")
+    all_consumption = df["consumption"].to_numpy(dtype = float)
+    if self.last_date is None:
+      return self.rebuild(all_dates, all_consumption)
+    new = all_dates > self.last_date
+    # the new days only extend the seasons if the days already in them are unchanged
+    if daily_digest(all_dates[~new], all_consumption[~new]) != self.digest:
+      return self.rebuild(all_dates, all_consumption)
+    if not new.any():
+      return self
+    self.digest = daily_digest(all_dates, all_consumption)
+    dates, consumption = all_dates[new], all_consumption[new]
+    if self.typical_type == "heating":
+      months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+      # new summer days move the summer average that every heating value depends on
+      if ((months >= 6) & (months <= 8)).any():
+        return self.rebuild(np.concatenate([self.dates, dates]), np.concatenate([self.consumption, consumption]))
+      self.dates = np.concatenate([self.dates, dates])
+      self.consumption = np.concatenate([self.consumption, consumption])
+      consumption = (consumption - self.daily_not_heat).clip(min = 0)
+    self.append(dates, consumption)
+    return self
+
+  def rebuild(self, dates, consumption):
+    self.digest = daily_digest(dates, consumption)
+    if self.typical_type == "heating":
+      self.dates = dates
+      self.consumption = consumption
+      months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+      self.daily_not_heat = np.nanmean(consumption[(months >= 6) & (months <= 8)])
+      consumption = heating_consumption(dates, consumption)
+    season, dos = season_days(dates, self.month_number)
+    self.seasons, self.cumulative = season_matrix(consumption, season, dos)
+    self.total = np.nansum(consumption[season == self.seasons[-1]])
+    self.last_date = dates[-1]
+    self.current_dos = dos[-1]
+    return self
+
+  def append(self, dates, consumption):
+    season, dos = season_days(dates, self.month_number)
+    for s in np.unique(season):
+      if s > self.seasons[-1]:
+        self.seasons = np.append(self.seasons, s)
+        self.cumulative = np.column_stack([self.cumulative, np.full(366, np.nan)])
+        self.total = 0
+      in_season = season == s
+      values = consumption[in_season]
+      cumulative = self.total + np.cumsum(np.nan_to_num(values))
+      self.cumulative[dos[in_season], -1] = np.where(np.isnan(values), np.nan, cumulative)
+      self.total = cumulative[-1]
+    self.last_date = dates[-1]
+    self.current_dos = dos[-1]
+
+  def pivot(self):
+    return label_season_matrix(self.seasons, self.cumulative, self.month_number)
+
+season_accumulators = {}
+
+# pivots for a household kept across sessions in this process, updated with any days newer than last time
+def accumulated_pivots(key, df, month_number, typical_types = ("overall", "heating")):
+  pivots = {}
+  for typical_type in typical_types:
+    accumulator = season_accumulators.get((key, month_number, typical_type))
+    if accumulator is None:
+      if len(season_accumulators) >= 1024:
+        season_accumulators.pop(next(iter(season_accumulators)))
+      accumulator = season_accumulators[(key, month_number, typical_type)] = SeasonAccumulator(month_number, typical_type)
+    pivots[typical_type] = accumulator.update(df).pivot()
+  return pivots
+
+# pivots shared between worker processes, keyed by the daily use itself. any that are missing are
+# built by this process's accumulators for the household
+def shared_pivots(key, df, month_number, typical_types = ("overall", "heating")):
+  digest = daily_digest(df.index.to_numpy(dtype = "datetime64[D]"), df["consumption"].to_numpy(dtype = float))
+  keys = {typical_type: f"{digest}-{month_number}-{typical_type}" for typical_type in typical_types}
+  pivots = {typical_type: cache.read_frame("pivots", k) for typical_type, k in keys.items()}
+  missing = tuple(typical_type for typical_type, piv in pivots.items() if piv is None)
+  if missing:
+    for typical_type, piv in accumulated_pivots(key, df, month_number, missing).items():
+      pivots[typical_type] = cache.store_frame("pivots", keys[typical_type], piv)
+  return pivots
+
+bench_skew = 0.4
+bench_cols = ["#2ecc71 ", "#82e0aa", "#f1948a", "#e74c3c"]
+bench_categories = ["Lowest 25%", "Below average", "Above average", "Highest 25%"]
+
+# spread of use around the typical annual use
+def typical_gas_sd(typical_gas_sum):
+	return 2809.077 * np.exp(0.00005240616 * typical_gas_sum)
+
+# percentile of actual use in the skewed distribution of typical use, the quartile band it falls in
+# and the boundaries between the bands. works on scalars or on arrays of households
+def benchmark_position(mean, sd, actual):
+	from scipy.stats import skewnorm
+	percentile = skewnorm.cdf(actual, bench_skew, loc = mean, scale = sd)
+	band = np.minimum(np.floor(percentile * 4), 3).astype(int)
+	return {"percentile": percentile * 100, "band": np.array(bench_categories)[band], "boundaries": bench_boundaries(mean, sd)}
+
+def bench_boundaries(mean, sd):
+	from scipy.stats import skewnorm
+	return skewnorm.ppf(np.array([0.25, 0.5, 0.75]), bench_skew, loc = np.expand_dims(mean, -1), scale = np.expand_dims(sd, -1))
+
+# outline of the area under the distribution in each band, cached as it only changes with the typical use
+@metrics.watch_cache
+@functools.lru_cache(maxsize = 256)
+def bench_bands(mean, sd):
+	from scipy.stats import skewnorm
+	edges = np.concatenate([[0], bench_boundaries(mean, sd), [mean + (3 * sd)]]).clip(0, mean + (3 * sd))
+	bands = []
+	for lo, hi in zip(edges[:-1], edges[1:]):
+		x = np.linspace(lo, hi, 50)
+		y = skewnorm.pdf(x, bench_skew, loc = mean, scale = sd)
+		bands.append((np.concatenate([x, [hi, lo]]), np.concatenate([y, [0, 0]])))
+	return bands
+
 def bench_fig(mean, sd, actual, energy_type):
-	dist_x = np.arange(0, mean + (3 * sd), 10)
-	#use_dist = scipy.stats.norm.pdf(dist_x,loc=mean,scale=sd)
-	use_dist = scipy.stats.skewnorm.pdf(dist_x, 0.4, loc = mean, scale = sd)
+	import plotly.graph_objects as go
 	fig = go.Figure()
-	bdf = pd.DataFrame({"x" : dist_x, "y" : use_dist})
-	bdf["cum"] = bdf["y"].cumsum()/bdf["y"].sum()
-	limits = np.arange(0.25, 1.25, 0.25)
-	bench_cols = ["#2ecc71 ", "#82e0aa", "#f1948a", "#e74c3c"]
-	categories = ["Lowest 25%", "Below average", "Above average", "Highest 25%"]
-	for l, c, n in zip(limits, bench_cols, categories):
-	    block = bdf.loc[(bdf["cum"] >= l-0.25) & (bdf["cum"] < l)]
-	    close = pd.DataFrame({"x":[block["x"].max(), block["x"].min()], "y":[0, 0]})
-	    block = pd.concat([block, close])
-	    fig.add_trace(go.Scatter(x = block["x"], y = block["y"], fill = "toself", fillcolor = c, line_color = c, name = n))
+	bands = bench_bands(mean, sd)
+	for (x, y), c, n in zip(bands, bench_cols, bench_categories):
+	    fig.add_trace(go.Scatter(x = x, y = y, fill = "toself", fillcolor = c, line_color = c, name = n))
 	fig.add_vline(x = actual, line_width = 2, line_color = "black")
 	fig.update_layout(xaxis_title = f"{energy_type.capitalize()} use (kWh)", legend=dict(y=1.1, orientation="h"),
   	xaxis = dict(showgrid = False), yaxis=dict(showgrid = False), plot_bgcolor = "white")
+	peak = max(y.max() for x, y in bands)
 	if actual > mean:
-		fig.add_annotation(x = actual, y = max(use_dist) * 0.66, text = f"Your {energy_type} use <br> in the last year", showarrow = False, xanchor = "right")
+		fig.add_annotation(x = actual, y = peak * 0.66, text = f"Your {energy_type} use <br> in the last year", showarrow = False, xanchor = "right")
 	if actual <=  mean:
-		fig.add_annotation(x = actual, y = max(use_dist) * 0.66, text = f"Your {energy_type} use <br> in the last year", showarrow = False, xanchor = "left")
+		fig.add_annotation(x = actual, y = peak * 0.66, text = f"Your {energy_type} use <br> in the last year", showarrow = False, xanchor = "left")
 	fig.update_yaxes(visible = False)
 	return fig
-
-def compare_years(df, yesterday):
-  result = pd.DataFrame()
-  years = df.index.year.unique()
-  date = yesterday[5:]
-  
-  for year in years:
-    end_date = pd.to_datetime(f'{year}-{date}')
-    start_date = end_date - pd.Timedelta(days=30)
-    mask = (df.index >= start_date) & (df.index <= end_date)
-    result = pd.concat([result, df[mask]])
-  return result
-
-def expected_from_temperature(temperatures, baseline_temp, baseline_values):
-  from scipy.stats import linregress
-  model = linregress(baseline_temp, baseline_values)
-  slope = model[0]
-  intercept = model[1]
-  expected = []
-  for t in temperatures:
-    if t < 17.5:
-        expected.append(intercept + (slope * t)) 
-    if t >= 17.5:
-        expected.append(min(baseline_values))
-  return(expected)
-
-  
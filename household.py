@@ -0,0 +1,89 @@
+import dataclasses
+import numpy as np
+import pandas as pd
+
+import functions as fx
+
+co2_per_kwh = 0.203
+
+# everything the value boxes and benchmark need about a household, worked out once from its daily use
+# and typical use. frozen so a session can share it between renders without any of them changing it
+@dataclasses.dataclass(frozen = True)
+class HouseholdSummary:
+  latest_gas_sum: float
+  latest_cost: float
+  total_gas: float
+  typical_gas_sum: float
+  typical_gas_sd: float
+  n_years: int
+  current_dos: int
+  typical_this_year: float
+  typical_cost: float
+  actual_cost: float
+  # (season, total) in order, the current season so far last
+  season_totals: tuple
+  heating_season_totals: tuple
+
+  @property
+  def overall_gas_diff(self):
+    return (self.typical_gas_sum * self.n_years) + self.typical_this_year - self.total_gas
+
+  @property
+  def gas_diff_percent(self):
+    return (self.typical_gas_sum - self.latest_gas_sum) / self.typical_gas_sum * 100
+
+  @property
+  def co2(self):
+    return self.latest_gas_sum * co2_per_kwh
+
+  @property
+  def co2_diff(self):
+    return self.overall_gas_diff * co2_per_kwh
+
+  @property
+  def cost_diff(self):
+    return self.typical_cost - self.actual_cost
+
+  # the heating use of the last complete season
+  @property
+  def previous_heating_total(self):
+    return self.heating_season_totals[-2][1] if len(self.heating_season_totals) > 1 else np.nan
+
+def season_totals(seasons):
+  return tuple(zip(seasons.columns, seasons.ffill().iloc[-1].to_numpy().tolist()))
+
+def summarise_household(daily_gas, seasons, typical_gas):
+  consumption = daily_gas["consumption"].to_numpy(dtype = float)
+  cost = daily_gas["cost"].to_numpy(dtype = float)
+  typical_cum = typical_gas["cum"].to_numpy()
+  overall = seasons["overall"]
+  current = overall.iloc[:, -1].to_numpy()
+  current_dos = int(np.flatnonzero(~np.isnan(current))[-1])
+  typical_cost = fx.get_typical_gas_cost(typical_gas, daily_gas)
+  return HouseholdSummary(
+    latest_gas_sum = float(consumption[-365:].sum()),
+    latest_cost = float(cost[-365:].sum()),
+    total_gas = float(consumption.sum()),
+    typical_gas_sum = float(typical_cum[-1]),
+    typical_gas_sd = float(fx.typical_gas_sd(typical_cum[-1])),
+    n_years = len(overall.columns) - 1,
+    current_dos = current_dos,
+    typical_this_year = float(typical_cum[current_dos]),
+    typical_cost = float(typical_cost["typical_cost"].sum()),
+    actual_cost = float(typical_cost["cost"].sum()),
+    season_totals = season_totals(overall),
+    heating_season_totals = season_totals(seasons["heating"])
+  )
+
+# benchmark daily use in each band of temperature, relative to the household's own use at 15 to 20°C over the last year,
+# derived from the SERL data by temperature (volume 2, Figure 5)
+temperature_response = [13.09, 10.45, 7.07, 2.95, 1, 0.75]
+temperature_bin_edges = [-5, 0, 5, 10, 15, 20, 25]
+temperature_bin_labels = ["-5 to 0", "0 to 5", "5 to 10", "10 to 15", "15 to 20", "20 to 25"]
+
+def temperature_bins(climate):
+  df = climate.tail(365)
+  bins = pd.cut(df["tavg"], bins = temperature_bin_edges, labels = temperature_bin_labels, right = False).rename("temperature_bins")
+  mean_values = df[["consumption", "tavg"]].groupby(bins, observed = False).mean()
+  mean_values["benchmark"] = np.array(temperature_response) * mean_values["consumption"].iloc[4]
+  return mean_values
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that importing the app, which is most of a worker's cold start, stays within budget
+and that the modules only needed later are still deferred
+
+python import_budget.py [--budget 1.5] [--repeat 3]
+
+Exits with 1 if the fastest of the imports is over budget or a deferred module was imported.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# only needed once a session asks for them
+deferred = ["methods", "scipy.stats", "meteostat"]
+
+# cumulative microseconds for each module from python -X importtime, keeping the top level imports of module apart
+def import_times(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output = True, text = True, check = True)
+    times = {}
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+        if name.startswith("   ") and not name.startswith("     "):
+            top_level[name.strip()] = int(cumulative)
+    return times, top_level
+
+def check(module = "app", budget = 1.5, repeat = 3):
+    # the first run also fills the caches a deployed worker would find already built
+    runs = [import_times(module) for _ in range(repeat + 1)][1:]
+    times, top_level = min(runs, key = lambda run: run[0][module])
+    seconds = times[module] / 1e6
+    print(f"import {module}: {seconds:.2f}s (budget {budget:.2f}s)")
+    for name, us in sorted(top_level.items(), key = lambda item: -item[1])[:10]:
+        print(f"  {name:<30}{us / 1e6:.3f}s")
+    loaded = [name for name in deferred if name in times]
+    if loaded:
+        print(f"imported at start up but should be deferred: {', '.join(loaded)}")
+    return seconds <= budget and not loaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the time taken to import the app")
+    parser.add_argument("--module", default = "app")
+    parser.add_argument("--budget", type = float, default = 1.5, help = "seconds")
+    parser.add_argument("--repeat", type = int, default = 3)
+    args = parser.parse_args()
+    sys.exit(0 if check(args.module, args.budget, args.repeat) else 1)
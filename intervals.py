@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+epoch = np.datetime64("2020-01-01T00:00", "m")
+local_tz = "Europe/London"
+
+# totals of kwh for each run of equal (sorted) periods
+def rollup(periods, kwh):
+  starts, first = np.unique(periods, return_index = True)
+  totals = np.add.reduceat(kwh.astype(np.float64), first) if len(kwh) > 0 else np.array([])
+  readings = np.diff(np.append(first, len(periods)))
+  return {"interval_start": starts, "consumption": totals, "readings": readings}
+
+# half-hourly readings held as int32 minutes since the epoch (UTC) and float32 kWh, with daily,
+# weekly and monthly totals by local date worked out once so the daily views never touch the readings
+class IntervalStore:
+
+  def __init__(self, interval_start, kwh):
+    minutes = (np.asarray(interval_start, dtype = "datetime64[m]") - epoch).astype(np.int32)
+    order = np.argsort(minutes, kind = "stable")
+    self.minutes = minutes[order]
+    self.kwh = np.asarray(kwh, dtype = np.float32)[order]
+    days = self.local_times().astype("datetime64[D]")
+    weekday = (days.astype(int) + 3) % 7
+    self.tiers = {
+      "day": rollup(days, self.kwh),
+      # weeks end on Sunday as with pandas' "W" resampling
+      "week": rollup(days + (6 - weekday).astype("timedelta64[D]"), self.kwh),
+      "month": rollup(days.astype("datetime64[M]").astype("datetime64[D]"), self.kwh)
+    }
+
+  def __len__(self):
+    return len(self.minutes)
+
+  def timestamps(self):
+    return epoch + self.minutes.astype("timedelta64[m]")
+
+  def local_times(self):
+    utc = pd.DatetimeIndex(self.timestamps()).tz_localize("UTC")
+    return utc.tz_convert(local_tz).tz_localize(None).to_numpy()
+
+  # totals per local day, week or month with the number of readings in each
+  def tier(self, name):
+    return pd.DataFrame(self.tiers[name])
+
+  # half-hourly readings between two UTC times, end exclusive
+  def readings(self, start = None, end = None):
+    lo = 0 if start is None else np.searchsorted(self.minutes, (np.datetime64(start, "m") - epoch).astype(np.int32))
+    hi = len(self) if end is None else np.searchsorted(self.minutes, (np.datetime64(end, "m") - epoch).astype(np.int32))
+    return pd.DataFrame({"interval_start": self.timestamps()[lo:hi], "consumption": self.kwh[lo:hi]})
+
+  # mean use in each local half hour of the day, e.g. to see when the heating comes on
+  def day_profile(self, start = None, end = None):
+    df = self.readings(start, end)
+    local = pd.DatetimeIndex(df["interval_start"]).tz_localize("UTC").tz_convert(local_tz)
+    slot = local.hour * 2 + local.minute // 30
+    profile = np.bincount(slot, weights = df["consumption"], minlength = 48) / np.maximum(np.bincount(slot, minlength = 48), 1)
+    return pd.DataFrame({"time": [f"{s // 2:02d}:{(s % 2) * 30:02d}" for s in range(48)], "consumption": profile})
@@ -1,5 +1,6 @@
-import pickle
 import copy
+import gzip
+import os
 import pandas as pd
 import numpy as np
 import plotly.express as px
@@ -104,5 +105,8 @@ occupancy_fig.add_trace(go.Scatter(x=np.arange(1,300), y=exp_model(np.arange(1,3
 occupancy_fig.add_trace(go.Scatter(x=exp_model(np.arange(1,8),*area_from_occup_popt),y=np.arange(1,8), name="Area from occupancy", mode="lines"))
 plots["occupancy_fig"] = occupancy_fig
 
-with open("method_plots.pkl", "wb") as f:
-    pickle.dump(plots, f)
+# the figures are served as static files and drawn in the browser so the app never builds them
+os.makedirs("www/method_plots", exist_ok = True)
+for name, fig in plots.items():
+    with gzip.open(f"www/method_plots/{name}.json.gz", "wt", compresslevel = 9) as f:
+        f.write(fig.to_json())
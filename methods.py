@@ -1,6 +1,13 @@
-from shiny import ui, render, module
-from shinywidgets import output_widget, render_plotly
-import pickle
+from pathlib import Path
+from htmltools import HTMLDependency
+from shiny import ui, module
+
+# the About tab is rendered on first view, so these are only fetched by sessions that open it
+prism_dep = HTMLDependency("prism", "1.29.0", source = {"href": "https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0"},
+    script = [{"src": "prism.min.js"}, {"src": "components/prism-python.min.js"}], stylesheet = {"href": "themes/prism.min.css"})
+plotly_dep = HTMLDependency("plotly", "3.0.1", source = {"href": "https://cdn.plot.ly"}, script = {"src": "plotly-3.0.1.min.js"})
+method_plots_dep = HTMLDependency("method-plots", "1.0", source = {"subdir": str(Path(__file__).parent / "www")},
+    script = {"src": "method_plots.js"}, all_files = False)
 
 code_one ="""
 df = get_serl_data(1, "Figure_21")
@@ -62,19 +69,16 @@ popt, pcov = curve_fit(gen_log_model, df["cum_days"], df["cum_value_norm"],p0=st
 cum_norm_fig.add_trace(go.Scatter(x=np.arange(1,366), y=gen_log_model(np.arange(1,366), *popt), name="gen_log_model"))
 """
 
+# figures built by method_plots.py, drawn in the browser from www/method_plots
+def method_plot(name):
+    return ui.div(class_ = "method-plot", style = "height: 450px;", data_src = f"method_plots/{name}.json.gz")
+
 @module.ui
 def methods_ui():
     return [
-      ui.tags.link(
-        rel = "stylesheet",
-        href = "https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism.min.css"
-      ),
-      ui.tags.script(
-        src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"
-      ),
-      ui.tags.script(
-        src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-python.min.js"
-      ),
+      prism_dep,
+      plotly_dep,
+      method_plots_dep,
       ui.h2("Methods"),
       ui.markdown("This application allows you to view your smart meter data and provide context to see how much energy you use relative to other similar households. It relies on data from a representative sample of 13000 households collected by the [Smart Energy Research Lab at UCL](https://serl.ac.uk/). They have produced a [report](https://discovery.ucl.ac.uk/id/eprint/10148066/1/SERL%20Stats%20Report%201.pdf), published a [paper](https://doi.org/10.1016/j.enbuild.2022.111845) and made the [summary data](https://rdr.ucl.ac.uk/ndownloader/files/35857037) available. Coming from a naive position as an energy researcher, but with previous experience benchmarking the performance of potato crops, I was surprised that there aren't any similar applications out there (as far as I can tell)."),
       ui.h3("Limitations"),
@@ -88,73 +92,27 @@ def methods_ui():
       ui.tags.pre(
         ui.tags.code(code_one, {"class": "language-python"})
       ),
-      output_widget("cum_fig"),
+      method_plot("cum_fig"),
       ui.markdown("This looked promising as now the data for each class of floor area looks like it can be described well by a logistic curve. I was curious how it would look if all the values for each class of floor area were divided by the total as it would be simplest if the pattern through the year was independent of floor area."),
       ui.tags.pre(
         ui.tags.code(code_two, {"class": "language-python"})
       ),
-      output_widget("cum_norm_fig"),
+      method_plot("cum_norm_fig"),
       ui.markdown("Because there are such small differences in the normalised cumulative values, we'll go ahead and just fit one curve to all the data. The curve fitting function needs some help to find initial values and we also need to restrain `a` to be greater than zero or else we could end up predicting days with negative energy consumption."),
       ui.tags.pre(
         ui.tags.code(code_three, {"class": "language-python"})
       ),
-      output_widget("cum_norm_fig_b"),
+      method_plot("cum_norm_fig_b"),
       ui.markdown("That looks reasonable and has a high *R<sup>2<sup/>* but the fit for the first few months is pretty poor (This is a nice example of why [*R<sup>2<sup/>* sucks](https://data.library.virginia.edu/is-r-squared-useless/) for evaulating models). There are a couple of tweaks that can be made to improve the fit. First of all, resetting the month_dum to start in July rather than August as this might affect the feasibility of fitting the curve and second using a generalised logistic curve instead which has an extra parameter."),
       ui.tags.pre(
         ui.tags.code(code_four, {"class": "language-python"})
       ),
-      output_widget("cum_norm_fig_c"),
+      method_plot("cum_norm_fig_c"),
       ui.markdown("I'm pretty happy with this fit now, but to be able to convert these values back to actual gas usage, we need to look at the relationship between floor area and total gas usage. Helpfully, the data includes the actual mean floor area for each class as well as the class and so we'll use that to fit a power model"),
-      output_widget("total_fig"),
+      method_plot("total_fig"),
       ui.markdown("Now we can use both models to produce estimates of the monthly totals and compare then with the actual values:"),
-      output_widget("model_compare_fig"),
+      method_plot("model_compare_fig"),
       ui.markdown("Whilst by no means perfect, the fit is satisfactory, but a challenge remains to account for how many occupants there are in the household. Ideally we would have the data available for every household so that we could build a model, but in the data we\"ve looked at so far we only have the median consumption for each category of floor area and the mean occupants in each category of floor area. In another figure though, there is data on the median usage depending on the number of occupants and the mean floor area for each category of occupancy. As we might expect, the two are inter-related - households with a larger floor area tend to have more occupants "),
-      output_widget("occupancy_fig")
+      method_plot("occupancy_fig"),
+      ui.tags.script("methodPlots();")
     ]
-
-@module.server
-def methods_server(input, output, session):
-  
-  with open("method_plots.pkl", "rb") as f:
-    method_plots = pickle.load(f)
-  
-  
-#   for key, val in method_plots.items():
-#     # Define the function as a string, applying the decorator
-#     function_code = f"""
-# @render_plotly
-# def {key}():
-#   return method_plots['{key}']
-# """
-#     # Execute the generated function code in the global scope
-#     exec(function_code, globals())
-
-  @render_plotly
-  def cum_fig():
-    return method_plots["cum_fig"]
-
-  @render_plotly
-  def cum_norm_fig():
-    return method_plots["cum_norm_fig"]
-
-  @render_plotly
-  def cum_norm_fig_b():
-    return method_plots["cum_norm_fig_b"]
-
-  @render_plotly
-  def cum_norm_fig_c():
-    return method_plots["cum_norm_fig_c"]
-  
-  @render_plotly
-  def total_fig():
-    return method_plots["total_fig"]
-  
-  @render_plotly
-  def model_compare_fig():
-    return method_plots["model_compare_fig"]
-  
-  @render_plotly
-  def occupancy_fig():
-    return method_plots["occupancy_fig"]
-
-  
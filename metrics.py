@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# one json object per line for the traced sessions
+logger = logging.getLogger("gasbench.metrics")
+logger.setLevel(logging.INFO)
+if not logger.handlers:
+  logger.addHandler(logging.StreamHandler())
+  logger.propagate = False
+
+lock = threading.Lock()
+timings = defaultdict(lambda: {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+cache_counts = defaultdict(lambda: {"hits": 0, "misses": 0})
+lru_caches = {}
+# events of the sessions that asked to be traced, by session id
+traces = {}
+trace_all = bool(os.getenv("GASBENCH_TRACE"))
+
+# req() stops a calc or render by raising these, which isn't a failure
+silent_exceptions = ("SilentException", "SilentCancelOutputException", "SilentOperationInProgressException")
+
+def current_session_id():
+  # batch and the benchmarks use functions without shiny, so it is only looked up once the app has imported it
+  if "shiny" not in sys.modules:
+    return None
+  from shiny.session import get_current_session
+  session = get_current_session()
+  return session.id if session is not None else None
+
+def trace(event):
+  session_id = current_session_id()
+  if session_id in traces:
+    event = {"session": session_id, "time": round(time.time(), 3), **event}
+    traces[session_id].append(event)
+    logger.info(json.dumps(event))
+
+def record(kind, name, seconds, error = False):
+  with lock:
+    timing = timings[(kind, name)]
+    timing["calls"] += 1
+    timing["errors"] += error
+    timing["seconds"] += seconds
+    timing["max_seconds"] = max(timing["max_seconds"], seconds)
+  trace({"kind": kind, "name": name, "ms": round(seconds * 1000, 3), "error": error})
+
+def cache_hit(name, hit):
+  with lock:
+    cache_counts[name]["hits" if hit else "misses"] += 1
+  trace({"kind": "cache", "name": name, "hit": hit})
+
+# functools.lru_cache functions keep their own counts, which are read when the metrics are
+def watch_cache(func):
+  lru_caches[func.__name__] = func
+  return func
+
+@contextlib.contextmanager
+def timer(kind, name):
+  start = time.perf_counter()
+  error = False
+  try:
+    yield
+  except BaseException as e:
+    error = type(e).__name__ not in silent_exceptions
+    raise
+  finally:
+    record(kind, name, time.perf_counter() - start, error)
+
+# time every call of a reactive calc, render function or external request, e.g.
+# @reactive.calc
+# @metrics.instrument("calc")
+def instrument(kind, name = None):
+  def decorator(func):
+    label = name or func.__name__
+    if asyncio.iscoroutinefunction(func):
+      @functools.wraps(func)
+      async def wrapper(*args, **kwargs):
+        with timer(kind, label):
+          return await func(*args, **kwargs)
+    else:
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        with timer(kind, label):
+          return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def start_trace(session_id):
+  traces.setdefault(session_id, [])
+
+# log the totals for a traced session as it ends
+def end_trace(session_id):
+  events = traces.pop(session_id, None)
+  if events is None:
+    return
+  summary = defaultdict(lambda: {"calls": 0, "ms": 0.0})
+  for event in events:
+    if "ms" in event:
+      summary[f"{event['kind']}/{event['name']}"]["calls"] += 1
+      summary[f"{event['kind']}/{event['name']}"]["ms"] += event["ms"]
+  logger.info(json.dumps({"session": session_id, "summary": summary}))
+
+def snapshot():
+  with lock:
+    result = {
+      "timings": [{"kind": kind, "name": name, **timing} for (kind, name), timing in sorted(timings.items())],
+      "caches": {name: dict(counts) for name, counts in sorted(cache_counts.items())}
+    }
+  for name, func in sorted(lru_caches.items()):
+    info = func.cache_info()
+    result["caches"][name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+  return result
+
+# the snapshot in the Prometheus text format
+def exposition():
+  data = snapshot()
+  families = {
+    "gasbench_calls_total": ("counter", "Number of calls", "calls"),
+    "gasbench_errors_total": ("counter", "Number of calls that raised an error", "errors"),
+    "gasbench_seconds_total": ("counter", "Wall time of all calls in seconds", "seconds"),
+    "gasbench_seconds_max": ("gauge", "Longest call in seconds", "max_seconds")
+  }
+  lines = []
+  for family, (kind, description, field) in families.items():
+    lines += [f"# HELP {family} {description}", f"# TYPE {family} {kind}"]
+    lines += [f'{family}{{kind="{t["kind"]}",name="{t["name"]}"}} {t[field]}' for t in data["timings"]]
+  for field, kind in [("hits", "counter"), ("misses", "counter"), ("size", "gauge")]:
+    family = f"gasbench_cache_{field}" + ("_total" if kind == "counter" else "")
+    lines += [f"# HELP {family} Cache {field}", f"# TYPE {family} {kind}"]
+    lines += [f'{family}{{cache="{name}"}} {counts[field]}' for name, counts in data["caches"].items() if field in counts]
+  return "\n".join(lines) + "\n"
+
+async def endpoint(request):
+  from starlette.responses import JSONResponse, PlainTextResponse
+  if request.query_params.get("format") == "json":
+    return JSONResponse(snapshot())
+  return PlainTextResponse(exposition(), media_type = "text/plain; version=0.0.4")
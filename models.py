@@ -4,53 +4,105 @@
 Created on Thu Oct 31 17:34:40 2024
 
 @author: simon
+
+Fits the typical gas use models to the SERL data and saves them with their
+covariances and fit diagnostics to fitted_models.json. The models are only
+refitted when the SERL workbook has changed since the last fit.
+
+python models.py [--force]
 """
 
+import argparse
+import datetime
+import json
 import functions as fx
 import pandas as pd
 from scipy.optimize import curve_fit
 import numpy as np
-import pickle
-
-df = fx.get_serl_data(1, "Figure_21")
-df["date"] = pd.to_datetime(df["summary_time"], format = "%b-%y")
-df["month"] = df["date"].dt.month
-df["month_dum"] = np.where(df["month"] < 7, df["month"] + 6, df["month"] - 6)
-df["days_per_month"] = df["date"].dt.days_in_month
-df["monthly_total"] = df["days_per_month"] * df["value"]
-df = df.rename(columns={"segment_1_value": "floor_area"}).sort_values(by = ["floor_area", "month_dum"])
-df["cum_value"] = df.groupby(["floor_area"])["monthly_total"].cumsum()
-df["cum_days"] = df.groupby(["floor_area"])["days_per_month"].cumsum()
-df["cum_value_norm"] = df.groupby(["floor_area"])["monthly_total"].transform(lambda x: (x.cumsum() / x.sum()))
-   
-starting_values = [10/np.mean(df["cum_days"]), np.mean(df["cum_value_norm"]), np.mean(df["cum_days"]), 2]
-bounds = (0, [1, 2, 200, 3])
-gas_from_day_popt, gas_from_day_pcov = curve_fit(fx.gen_log_model, df["cum_days"], df["cum_value_norm"], p0 = starting_values, bounds = bounds)
-   
-tdf = df.groupby(["floor_area"]).agg({"mean_floor_area": "min", "monthly_total": "sum"})
-starting_values = [np.max(tdf["mean_floor_area"]), 1]
-total_from_area_popt, total_from_area_pcov = curve_fit(fx.pow_model, tdf["mean_floor_area"], tdf["monthly_total"],p0 = starting_values)
-   
-odf = fx.get_serl_data(1, "Figure_14")
-odf = odf.loc[odf["fuel"] == "Gas"]
-odf = odf.dropna(subset = ["mean_occupants"])
-starting_values = [odf["mean_occupants"].max(),(odf["mean_occupants"].max() - odf["mean_occupants"].min()) / odf["mean_occupants"].max(), (3/(odf["mean_floor_area"].max()-odf["mean_floor_area"].min()))]
-area_from_occup_popt, area_from_occup_pcov = curve_fit(fx.exp_model,odf["mean_occupants"], odf["mean_floor_area"], p0 = starting_values)
-   
-df = df.dropna(subset = ["mean_occupants"])
-starting_values = [df["mean_occupants"].max(), (df["mean_occupants"].max() - df["mean_occupants"].min()) / df["mean_occupants"].max(), (3/(df["mean_floor_area"].max()-df["mean_floor_area"].min()))]
-occup_from_area_popt, occup_from_area_pcov = curve_fit(fx.exp_model, df["mean_floor_area"], df["mean_occupants"], p0 = starting_values)
-
-pars = {}
-
-pars["gas_from_day_popt"] = gas_from_day_popt
-pars["gas_from_day_pcov"] = gas_from_day_pcov
-pars["total_from_area_popt"] = total_from_area_popt
-pars["total_from_area_pcov"] = total_from_area_pcov
-pars["occup_from_area_popt"] = occup_from_area_popt
-pars["occup_from_area_pcov"] = occup_from_area_pcov
-pars["area_from_occup_popt"] = area_from_occup_popt
-pars["area_from_occup_pcov"] = area_from_occup_pcov
-
-with open("fitted_models.pkl", "wb") as f:
-    pickle.dump(pars, f)
\ No newline at end of file
+
+import cache
+
+schema = 1
+
+def fit_diagnostics(model, x, y, popt):
+    residuals = y - model(x, *popt)
+    ss_res = np.sum(residuals**2)
+    ss_tot = np.sum((y - np.mean(y))**2)
+    return {"r_squared": float(1 - (ss_res / ss_tot)), "rmse": float(np.mean(residuals**2)**0.5), "n": int(len(x))}
+
+def model_entry(model, x, y, popt, pcov):
+    return {"function": model.__name__, "popt": np.asarray(popt).tolist(), "pcov": np.asarray(pcov).tolist(), **fit_diagnostics(model, x, y, popt)}
+
+# the data each model is fitted to as (model, x, y, starting values, bounds)
+def fit_data():
+    df = fx.get_serl_data(1, "Figure_21")
+    df["date"] = pd.to_datetime(df["summary_time"], format = "%b-%y")
+    df["month"] = df["date"].dt.month
+    df["month_dum"] = np.where(df["month"] < 7, df["month"] + 6, df["month"] - 6)
+    df["days_per_month"] = df["date"].dt.days_in_month
+    df["monthly_total"] = df["days_per_month"] * df["value"]
+    df = df.rename(columns={"segment_1_value": "floor_area"}).sort_values(by = ["floor_area", "month_dum"])
+    df["cum_value"] = df.groupby(["floor_area"])["monthly_total"].cumsum()
+    df["cum_days"] = df.groupby(["floor_area"])["days_per_month"].cumsum()
+    df["cum_value_norm"] = df.groupby(["floor_area"])["monthly_total"].transform(lambda x: (x.cumsum() / x.sum()))
+    data = {}
+
+    starting_values = [10/np.mean(df["cum_days"]), np.mean(df["cum_value_norm"]), np.mean(df["cum_days"]), 2]
+    bounds = (0, [1, 2, 200, 3])
+    data["gas_from_day"] = (fx.gen_log_model, df["cum_days"], df["cum_value_norm"], starting_values, bounds)
+    # fitted again with the three parameters gen_log_model depends on, whose covariance is not singular like gen_log_model's
+    data["gas_from_day_logistic"] = (fx.logistic_model, df["cum_days"], df["cum_value_norm"], starting_values[:3], (0, [1, 2, 366]))
+
+    tdf = df.groupby(["floor_area"]).agg({"mean_floor_area": "min", "monthly_total": "sum"})
+    starting_values = [np.max(tdf["mean_floor_area"]), 1]
+    data["total_from_area"] = (fx.pow_model, tdf["mean_floor_area"], tdf["monthly_total"], starting_values, (-np.inf, np.inf))
+
+    odf = fx.get_serl_data(1, "Figure_14")
+    odf = odf.loc[odf["fuel"] == "Gas"]
+    odf = odf.dropna(subset = ["mean_occupants"])
+    starting_values = [odf["mean_occupants"].max(),(odf["mean_occupants"].max() - odf["mean_occupants"].min()) / odf["mean_occupants"].max(), (3/(odf["mean_floor_area"].max()-odf["mean_floor_area"].min()))]
+    data["area_from_occup"] = (fx.exp_model, odf["mean_occupants"], odf["mean_floor_area"], starting_values, (-np.inf, np.inf))
+
+    df = df.dropna(subset = ["mean_occupants"])
+    starting_values = [df["mean_occupants"].max(), (df["mean_occupants"].max() - df["mean_occupants"].min()) / df["mean_occupants"].max(), (3/(df["mean_floor_area"].max()-df["mean_floor_area"].min()))]
+    data["occup_from_area"] = (fx.exp_model, df["mean_floor_area"], df["mean_occupants"], starting_values, (-np.inf, np.inf))
+    return data
+
+def fit_models():
+    models = {}
+    for name, (model, x, y, starting_values, bounds) in fit_data().items():
+        popt, pcov = curve_fit(model, x, y, p0 = starting_values, bounds = bounds)
+        models[name] = model_entry(model, x, y, popt, pcov)
+    return models
+
+def save_models(models, source_hash, path = "fitted_models.json"):
+    artifact = {
+        "schema": schema,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = "seconds"),
+        "source": fx.serl_workbooks[1],
+        "source_hash": source_hash,
+        "models": models
+    }
+    with open(path, "w") as f:
+        json.dump(artifact, f, indent = 2)
+
+def refit(force = False, path = "fitted_models.json"):
+    source_hash = cache.file_hash(fx.serl_workbooks[1])
+    try:
+        with open(path) as f:
+            fitted_hash = json.load(f)["source_hash"]
+    except FileNotFoundError:
+        fitted_hash = None
+    if not force and fitted_hash == source_hash:
+        return False
+    save_models(fit_models(), source_hash, path)
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Refit the typical gas use models if the SERL data has changed")
+    parser.add_argument("--force", action = "store_true", help = "refit even if the SERL data is unchanged")
+    args = parser.parse_args()
+    if refit(args.force):
+        print("Models refitted and saved to fitted_models.json")
+    else:
+        print("SERL data unchanged since the last fit, use --force to refit anyway")
@@ -0,0 +1,36 @@
+import warnings
+import numpy as np
+import pytest
+
+import degree_days as dd
+
+def test_fit_changepoint_recovers_base_temperature():
+  temperatures = np.linspace(0, 25, 200)
+  values = 5 + (2 * np.clip(15.5 - temperatures, 0, None))
+  fit = dd.fit_changepoint(temperatures, values)
+  assert fit["base_temperature"] == pytest.approx(15.5)
+  assert fit["slope"] == pytest.approx(2)
+  assert fit["baseload"] == pytest.approx(5)
+  assert fit["r_squared"] == pytest.approx(1)
+
+@pytest.mark.parametrize("temperatures, values", [
+  # constant use
+  (np.linspace(0, 25, 50), np.full(50, 3.0)),
+  # every day warmer than every base, so the degree days are all zero
+  (np.linspace(23, 30, 50), np.linspace(1, 2, 50)),
+  # the same temperature every day
+  (np.full(50, 5.0), np.linspace(1, 2, 50)),
+  # nothing left once the missing days are dropped
+  (np.full(5, np.nan), np.ones(5))
+])
+def test_fit_changepoint_degenerate_is_flat(temperatures, values):
+  with warnings.catch_warnings():
+    warnings.simplefilter("error")
+    fit = dd.fit_changepoint(temperatures, values)
+    response = dd.degree_day_response(temperatures, fit)
+  assert fit["slope"] == 0
+  assert np.isnan(fit["base_temperature"])
+  finite = np.isfinite(temperatures)
+  if finite.any():
+    assert fit["baseload"] == pytest.approx(values[finite].mean())
+    assert np.allclose(response, fit["baseload"])
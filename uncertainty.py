@@ -0,0 +1,62 @@
+import functools
+import numpy as np
+import pandas as pd
+
+import functions as fx
+import metrics
+
+# number of parameter samples, drawn with a fixed seed so every worker shows the same bands
+n_samples = 1000
+band_percentiles = (5, 50, 95)
+
+# through the eigendecomposition rather than a Cholesky factor so that covariances
+# which are only just positive semi-definite after rounding can still be sampled
+def draw(mean, cov, rng, n):
+  w, v = np.linalg.eigh(cov)
+  return mean + ((rng.standard_normal((n, len(mean))) * np.sqrt(w.clip(min = 0))) @ v.T)
+
+def parameters_key(parameters):
+  return tuple((k, tuple(np.ravel(v))) for k, v in sorted(parameters.items()))
+
+# samples of every model's parameters as columns, laid out like load_models() so they can be passed
+# straight to the model functions, which broadcast them against the days or the floor area
+@functools.lru_cache(maxsize = 4)
+def parameter_samples(parameters_key, n = n_samples, seed = 1):
+  parameters = {k: np.array(v) for k, v in parameters_key}
+  rng = np.random.default_rng(seed)
+  samples = {}
+  for name in ["total_from_area", "area_from_occup", "occup_from_area"]:
+    popt = parameters[f"{name}_popt"]
+    samples[f"{name}_popt"] = draw(popt, parameters[f"{name}_pcov"].reshape(len(popt), len(popt)), rng, n).T[:, :, None]
+  # gen_log_model's own pcov is singular, so its samples are drawn from the logistic fit and mapped back onto it
+  popt = parameters["gas_from_day_logistic_popt"]
+  b, k, m = draw(popt, parameters["gas_from_day_logistic_pcov"].reshape(len(popt), len(popt)), rng, n).T[:, :, None]
+  t = parameters["gas_from_day_popt"][3]
+  samples["gas_from_day_popt"] = (b, k * t, m - (np.log(t) / b), np.full_like(b, t))
+  return samples
+
+# daily typical use in the order of the model days for every parameter sample (n_samples x 366),
+# the gen_log, pow and occupancy models evaluated for all the samples at once
+@metrics.watch_cache
+@functools.lru_cache(maxsize = 32)
+def typical_gas_samples(parameters_key, floor_area, occupants, model_type):
+  samples = parameter_samples(parameters_key)
+  daily = fx.typical_gas_daily(samples["gas_from_day_popt"], model_type) * fx.typical_gas_scale(samples, floor_area, occupants)
+  daily = daily.astype(np.float32)
+  daily.setflags(write = False)
+  return daily
+
+@metrics.watch_cache
+@functools.lru_cache(maxsize = 1024)
+def cached_typical_gas_bands(parameters_key, floor_area, occupants, start_month, model_type):
+  daily = typical_gas_samples(parameters_key, floor_area, occupants, model_type)
+  t = fx.season_t(start_month)
+  bands = np.percentile(np.cumsum(daily[:, t - 1], axis = 1, dtype = float), band_percentiles, axis = 0)
+  df = pd.DataFrame({f"p{p}": band for p, band in zip(band_percentiles, bands)}, index = t)
+  df.insert(0, "date", pd.date_range(f"2023-{start_month:02d}-01", periods = 366))
+  return df
+
+# percentiles of the cumulative typical use on each day of the season from the uncertainty in the fitted models,
+# indexed by the day of the model (t) like get_typical_gas
+def get_typical_gas_bands(parameters, floor_area, occupants, start_month, model_type):
+  return cached_typical_gas_bands(parameters_key(parameters), floor_area, occupants, start_month, model_type).copy(deep = False)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Import station data into the local weather store so the app can run without meteostat
+
+python weather.py 03772.csv.gz 03769.csv.gz [--postcodes postcodes.csv]
+
+The station files are meteostat's daily bulk data (https://bulk.meteostat.net/v2/daily/03772.csv.gz),
+named by the station id and with the columns date, tavg, tmin, tmax, prcp, snow, wdir, wspd, wpgt, pres, tsun
+with or without a header. The optional postcodes file has the columns postcode, latitude, longitude and station
+so that the postcode and station lookups don't need postcodes.io or meteostat either.
+"""
+
+import argparse
+from pathlib import Path
+import pandas as pd
+
+import cache
+
+def import_station_csv(path, station = None):
+  station = station or Path(path).name.split(".")[0]
+  header = "date" in pd.read_csv(path, nrows = 0).columns
+  df = pd.read_csv(path, header = 0 if header else None, names = None if header else ["date", *cache.weather_columns],
+    parse_dates = ["date"], index_col = "date")
+  return cache.store_weather(station, df)
+
+def import_postcodes_csv(path):
+  df = pd.read_csv(path, dtype = {"station": str})
+  for row in df.itertuples():
+    postcode = row.postcode.replace(" ", "").upper()
+    cache.store_postcode(postcode, row.latitude, row.longitude)
+    cache.store_station(row.latitude, row.longitude, row.station)
+  return len(df)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description = "Import station data into the local weather store")
+  parser.add_argument("stations", nargs = "*", help = "daily station csv files, named by station id")
+  parser.add_argument("--postcodes", default = None, help = "csv of postcode, latitude, longitude, station")
+  args = parser.parse_args()
+
+  for path in args.stations:
+    print(f"{path}: {import_station_csv(path)} days")
+  if args.postcodes:
+    print(f"{args.postcodes}: {import_postcodes_csv(args.postcodes)} postcodes")
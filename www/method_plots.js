@@ -0,0 +1,27 @@
+// highlights the code and draws the prerendered Methods figures the first time each one scrolls into view,
+// called by the About tab once it has been rendered
+window.methodPlots = function () {
+  function draw(el) {
+    fetch(el.dataset.src)
+      .then(function (response) {
+        return new Response(response.body.pipeThrough(new DecompressionStream("gzip"))).json();
+      })
+      .then(function (fig) {
+        Plotly.newPlot(el, fig.data, fig.layout, {responsive: true});
+      });
+  }
+
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target);
+        draw(entry.target);
+      }
+    });
+  });
+
+  Prism.highlightAll();
+  document.querySelectorAll(".method-plot").forEach(function (el) {
+    observer.observe(el);
+  });
+};